@@ -5,6 +5,7 @@ import copy
 import datetime
 import json
 import pprint
+import urllib.parse
 import warnings
 
 import requests
@@ -149,6 +150,10 @@ class NodeInfo(object):
 
         q_params = copy.copy(self.filters.time_filters)
         q_params['limit'] = LIMIT
+        # Ask for cursor pagination - servers that support it return the
+        # cursor for the next page in the Link header, older servers just
+        # ignore the parameter.
+        q_params['cursor'] = ''
 
         data_payload = []
 
@@ -172,9 +177,15 @@ class NodeInfo(object):
                 if self.filters.verbose:
                     print('  ** got {0} results'.format(len(data)))
 
+                next_cursor = self._next_cursor(r)
+
                 if len(data) < LIMIT:
                     # got less than requested - done
                     break
+                elif next_cursor is not None:
+                    # resume from where the server says the page ended
+                    q_params['cursor'] = next_cursor
+                    continue
                 else:
                     # reset start time to last ts + 1 and loop
                     q_params['time-start'] = data[-1].get('ts') + 1
@@ -194,6 +205,15 @@ class NodeInfo(object):
 
         return data_payload
 
+    def _next_cursor(self, r):  # pylint: disable=no-self-use
+        """Pull the pagination cursor out of the next link in a
+        response, if there is one."""
+        next_url = r.links.get('next', {}).get('url')
+        if not next_url:
+            return None
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(next_url).query)
+        return query.get('cursor', [None])[0]
+
 
 class Metadata(NodeInfo):
     """Class to encapsulate a metadata object.  It exposes the
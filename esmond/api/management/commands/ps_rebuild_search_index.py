@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from esmond.api.models import PSMetadata
+from esmond.api.perfsonar.search import index_metadata
+
+class Command(BaseCommand):
+    help = 'Rebuild the perfSONAR metadata search index, e.g. after loading metadata from fixtures or raw SQL.'
+
+    def handle(self, *args, **options):
+        count = 0
+        with transaction.atomic():
+            for metadata in PSMetadata.objects.all().iterator():
+                index_metadata(metadata)
+                count += 1
+        print('Indexed {0} metadata objects'.format(count))
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PSMetadataDocument',
+            fields=[
+                ('metadata', models.OneToOneField(related_name='document', primary_key=True, serialize=False, to='api.PSMetadata')),
+                ('document', models.TextField()),
+            ],
+            options={
+                'db_table': 'ps_metadata_document',
+            },
+        ),
+    ]
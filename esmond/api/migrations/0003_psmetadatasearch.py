@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+
+import hashlib
+import itertools
+
+from django.db import migrations, models
+
+# GET parameter name -> (subject model, field) of the subject fields that 
+# can be searched on, see SUBJECT_FILTER_MAP
+SUBJECT_FIELDS = [
+    ('destination', 'pspointtopointsubject', 'destination'),
+    ('input-destination', 'pspointtopointsubject', 'input_destination'),
+    ('input-source', 'pspointtopointsubject', 'input_source'),
+    ('input-source', 'psnetworkelementsubject', 'input_source'),
+    ('measurement-agent', 'pspointtopointsubject', 'measurement_agent'),
+    ('measurement-agent', 'psnetworkelementsubject', 'measurement_agent'),
+    ('source', 'pspointtopointsubject', 'source'),
+    ('source', 'psnetworkelementsubject', 'source'),
+    ('tool-name', 'pspointtopointsubject', 'tool_name'),
+    ('tool-name', 'psnetworkelementsubject', 'tool_name'),
+]
+
+def search_row(PSMetadataSearch, metadata_id, kind, field, value):
+    value = str(value)
+    return PSMetadataSearch(metadata_id=metadata_id, kind=kind, field=field, value=value,
+        digest=hashlib.md5(value.encode('utf-8')).hexdigest())
+
+def build_search_index(apps, schema_editor):
+    PSMetadataSearch = apps.get_model('api', 'PSMetadataSearch')
+    def rows():
+        for filter_name, model_name, field in SUBJECT_FIELDS:
+            model = apps.get_model('api', model_name)
+            for metadata_id, value in model.objects.values_list('metadata_id', field).iterator():
+                yield search_row(PSMetadataSearch, metadata_id, 'subject', filter_name, value)
+        for metadata_id, key, value in apps.get_model('api', 'PSMetadataParameters').objects.values_list(
+                'metadata_id', 'parameter_key', 'parameter_value').iterator():
+            yield search_row(PSMetadataSearch, metadata_id, 'parameter', key, value)
+    #insert in batches so millions of rows are never in memory at once
+    it = rows()
+    while True:
+        batch = list(itertools.islice(it, 10000))
+        if not batch:
+            break
+        PSMetadataSearch.objects.bulk_create(batch)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_psmetadatadocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PSMetadataSearch',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('kind', models.CharField(max_length=16)),
+                ('field', models.CharField(max_length=128)),
+                ('value', models.TextField()),
+                ('digest', models.CharField(max_length=32)),
+                ('metadata', models.ForeignKey(related_name='pssearch', to='api.PSMetadata')),
+            ],
+            options={
+                'db_table': 'ps_metadata_search',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='psmetadatasearch',
+            index_together=set([('kind', 'field', 'digest', 'metadata')]),
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
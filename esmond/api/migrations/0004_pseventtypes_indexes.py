@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_psmetadatasearch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pseventtypes',
+            name='event_type',
+            field=models.CharField(max_length=128),
+        ),
+        migrations.AlterField(
+            model_name='pseventtypes',
+            name='metadata',
+            field=models.ForeignKey(related_name='pseventtypes', db_index=False, to='api.PSMetadata'),
+        ),
+        migrations.AddIndex(
+            model_name='pseventtypes',
+            index=models.Index(fields=['metadata', 'event_type', 'summary_type', 'summary_window'], name='ps_et_md_summary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pseventtypes',
+            index=models.Index(fields=['event_type', 'time_updated'], name='ps_et_type_updated_idx'),
+        ),
+        # time filters without an event type. event types that never got 
+        # data have no time_updated and can't match, so leave them out.
+        migrations.RunSQL(
+            "CREATE INDEX ps_et_updated_idx ON ps_event_types (time_updated) WHERE time_updated IS NOT NULL",
+            "DROP INDEX ps_et_updated_idx",
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_pseventtypes_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='psmetadatadocument',
+            name='time_updated',
+            field=models.DateTimeField(null=True),
+        ),
+        # -1 never matches, so documents stored before are built again
+        migrations.AddField(
+            model_name='psmetadatadocument',
+            name='event_type_count',
+            field=models.IntegerField(default=-1),
+            preserve_default=False,
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.utils.timezone import now
 import datetime
 
@@ -97,8 +98,11 @@ class PSNetworkElementSubject(models.Model):
         return "%s-%s" % (self.source, self.tool_name)
     
 class PSEventTypes(models.Model):
-    metadata = models.ForeignKey(PSMetadata, related_name='pseventtypes')
-    event_type =  models.CharField(max_length=128, db_index=True)
+    # metadata and event_type are indexed by the composite indexes below.
+    # time_updated also has a partial index (without NULLs) for time 
+    # filters without an event type, see migration 0004.
+    metadata = models.ForeignKey(PSMetadata, related_name='pseventtypes', db_index=False)
+    event_type =  models.CharField(max_length=128)
     summary_type =  models.CharField(max_length=128)
     summary_window =  models.BigIntegerField()
     time_updated = models.DateTimeField(null=True)
@@ -107,6 +111,12 @@ class PSEventTypes(models.Model):
         app_label = 'api'
         db_table = "ps_event_types"
         ordering = ["metadata","event_type", "summary_type", "summary_window"]
+        indexes = [
+            # event types of a metadata object, in the order they are listed
+            models.Index(fields=["metadata", "event_type", "summary_type", "summary_window"], name="ps_et_md_summary_idx"),
+            # event-type search filters, with or without time filters
+            models.Index(fields=["event_type", "time_updated"], name="ps_et_type_updated_idx"),
+        ]
     
     def __unicode__(self):
         return "%s:%s:%d" % (self.event_type, self.summary_type, self.summary_window)
@@ -129,6 +139,88 @@ class PSMetadataParameters(models.Model):
     def __unicode__(self):
         return "%s" % (self.parameter_key)
 
+class PSMetadataSearch(models.Model):
+    """
+    Search index of the metadata. Every subject field that can be searched
+    on and every parameter of a metadata object is a row here, so a search 
+    is an index lookup per filter on this one table instead of joins over 
+    the subject and parameter tables. Values are looked up by their digest
+    since parameter values can be too long to index.
+    """
+    metadata = models.ForeignKey(PSMetadata, related_name='pssearch')
+    kind = models.CharField(max_length=16)
+    field = models.CharField(max_length=128)
+    value = models.TextField()
+    digest = models.CharField(max_length=32)
+    
+    class Meta:
+        app_label = 'api'
+        db_table = "ps_metadata_search"
+        index_together = [["kind", "field", "digest", "metadata"]]
+    
+    def __unicode__(self):
+        return "%s:%s" % (self.kind, self.field)
+
+class PSMetadataDocument(models.Model):
+    """
+    The JSON document the archive endpoint lists for a metadata object,
+    kept so listing does not need to rebuild it from the subject, event
+    type and parameter tables on every request. time_updated and 
+    event_type_count are the latest time_updated and the number of the 
+    event types it was built from. It is built again when listed if they 
+    no longer match the event types, and deleted when anything it is built
+    from is changed through the ORM (see drop_metadata_document()).
+    """
+    metadata = models.OneToOneField(PSMetadata, primary_key=True, related_name='document')
+    document = models.TextField()
+    time_updated = models.DateTimeField(null=True)
+    event_type_count = models.IntegerField()
+    
+    class Meta:
+        app_label = 'api'
+        db_table = "ps_metadata_document"
+    
+    def __unicode__(self):
+        return "%s" % (self.metadata_id)
+
+def drop_metadata_document(sender, instance, **kwargs):
+    """
+    Signal handler deleting the stored document of the metadata of a 
+    subject, event type or parameter that was saved or deleted (ie: in the
+    admin), it is built again when next listed.
+    """
+    PSMetadataDocument.objects.filter(metadata_id=instance.metadata_id).delete()
+
+for model in [PSPointToPointSubject, PSNetworkElementSubject, PSEventTypes, PSMetadataParameters]:
+    post_save.connect(drop_metadata_document, sender=model)
+    post_delete.connect(drop_metadata_document, sender=model)
+
+def index_metadata_search(sender, instance, raw=False, **kwargs):
+    """
+    Signal handler rebuilding the search index rows (see PSMetadataSearch)
+    of the metadata of a subject or parameter that was saved (ie: in the 
+    admin). Loaded fixtures are left to whoever loads them.
+    """
+    if raw:
+        return
+    from esmond.api.perfsonar.search import index_metadata
+    index_metadata(instance.metadata)
+
+def unindex_metadata_search(sender, instance, **kwargs):
+    """
+    Signal handler deleting the search index rows of a subject or 
+    parameter that was deleted.
+    """
+    from esmond.api.perfsonar.search import unindex_parameter, unindex_subject
+    if sender is PSMetadataParameters:
+        unindex_parameter(instance.metadata_id, instance.parameter_key)
+    else:
+        unindex_subject(instance.metadata_id)
+
+for model in [PSPointToPointSubject, PSNetworkElementSubject, PSMetadataParameters]:
+    post_save.connect(index_metadata_search, sender=model)
+    post_delete.connect(unindex_metadata_search, sender=model)
+
 class UserIpAddress(models.Model):
     ip = CidrAddressField(unique=True, db_index=True)
     user = models.ForeignKey(User, related_name='user')
@@ -1,13 +1,16 @@
 import ast
+import atexit
 import calendar
 import collections
 import copy
 import datetime
 import hashlib
 import inspect
+import itertools
 import json
 import math
 import os
+import threading
 import time
 import urllib.parse
 import uuid
@@ -16,12 +19,17 @@ import pprint
 
 pp = pprint.PrettyPrinter(indent=4)
 
+from django.core.cache import caches
 from django.db import connection, transaction
-from django.db.models import Q
+from django.db.models import Count, Max, Q, prefetch_related_objects
 from django.utils.text import slugify
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.utils.timezone import utc
-from django.db.utils import DatabaseError
+from django.db.utils import DatabaseError, IntegrityError
+from django.http import HttpResponse, StreamingHttpResponse
 
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from socket import getaddrinfo, AF_INET, AF_INET6, SOL_TCP, SOCK_STREAM
 
 from rest_framework import (viewsets, serializers, status, 
@@ -29,32 +37,43 @@ from rest_framework import (viewsets, serializers, status,
 from rest_framework.exceptions import (ParseError, NotFound, MethodNotAllowed, APIException)
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.permissions import (DjangoModelPermissions, IsAuthenticatedOrReadOnly)
 from rest_framework.authentication import BaseAuthentication, TokenAuthentication
 
 import rest_framework_filters as filters
 
 from esmond.api.models import (PSMetadata, PSPointToPointSubject, PSEventTypes, 
-    PSMetadataParameters, PSNetworkElementSubject, UserIpAddress)
+    PSMetadataParameters, PSNetworkElementSubject, PSMetadataDocument, UserIpAddress)
 
 from esmond.api.perfsonar.types import *
+from esmond.api.perfsonar.downsample import REDUCE_FUNCTIONS, downsample
+from esmond.api.perfsonar.search import SEARCH_KIND_SUBJECT, SEARCH_KIND_PARAMETER, index_metadata_if_missing, search_filter
+from esmond.api.perfsonar.validators import DEFAULT_QUANTILES, histogram_statistics
 
-from esmond.cassandra import KEY_DELIMITER, CASSANDRA_DB, AGG_TYPES, ConnectionException, RawRateData, BaseRateBin, RawData, AggregationBin
+from esmond.cassandra import KEY_DELIMITER, CASSANDRA_DB, AGG_TYPES, ConnectionException, RawRateData, BaseRateBin, RawData, AggregationBin, get_rowkey
 
 from esmond.config import get_config_path, get_config
 
-from esmond.util import get_logger
+from esmond.util import get_logger, LRUCache
 
 #
 # Logger
 #
 log = get_logger(__name__)
 
+#
+# Esmond config
+#
+esmond_conf = get_config(get_config_path())
+
 #
 # Cassandra db connection
 #
 try:
-    db = CASSANDRA_DB(get_config(get_config_path()))
+    db = CASSANDRA_DB(esmond_conf)
     EVENT_TYPE_CF_MAP = {
             'histogram': db.raw_cf,
             'integer': db.rate_cf,
@@ -68,6 +87,350 @@ except ConnectionException as e:
     #corrects race condition with cassandra boot and esmond boot
     db = None
 
+def cf_map_key(col_fam):
+    """
+    Map a column family name to its key in the CASSANDRA_DB.cf_map
+    """
+    return {db.raw_cf: 'raw', db.rate_cf: 'rate', db.agg_cf: 'aggs', db.stat_cf: 'stat'}.get(col_fam)
+
+#
+# Cache of the summaries configured for each event type. The summaries of a 
+# metadata object are set when it is created and practically never change 
+# after that, so there is no need to look them up in the relational database
+# for every value written. This uses the 'summaries' django cache, which 
+# has to be shared between processes (ie: memcached, see summary_cache_* in
+# the config) for invalidate_summaries() to reach all of them. With the 
+# default per process cache a change can take summary_cache_ttl seconds to
+# be seen by other processes.
+#
+summary_cache = caches['summaries']
+
+def summary_cache_key(metadata_key, event_type):
+    return 'ps_summaries:%s:%s' % (metadata_key, event_type)
+
+def get_summaries(metadata_key, event_types):
+    """
+    Returns a dict mapping each event type in event_types to a list of 
+    (summary_type, summary_window) tuples ordered by summary_type. Event 
+    types not defined for the metadata map to an empty list. Anything not
+    in the cache is looked up with a single query.
+    """
+    keys = dict((et, summary_cache_key(metadata_key, et)) for et in event_types)
+    cached = summary_cache.get_many(list(keys.values()))
+    summaries = {}
+    missing = []
+    for et in event_types:
+        if keys[et] in cached:
+            summaries[et] = cached[keys[et]]
+        else:
+            summaries[et] = []
+            missing.append(et)
+    if not missing:
+        return summaries
+
+    #NOTE: Ordering in model allows statistics to go last. If this ever changes may need to update code here.
+    rawsql_cursor = connection.cursor()
+    in_clause = ','.join(['%s'] * len(missing))
+    rawsql_cursor.execute("SELECT event_type, summary_type, summary_window FROM ps_event_types WHERE event_type IN (" + in_clause + ") AND metadata_id=(SELECT id FROM ps_metadata WHERE metadata_key=%s) ORDER BY event_type, summary_type", missing + [metadata_key])
+    for et in rawsql_cursor.fetchall():
+        summaries[et[0]].append((et[1], et[2]))
+    summary_cache.set_many(dict((keys[et], summaries[et]) for et in missing), esmond_conf.summary_cache_ttl)
+
+    return summaries
+
+def invalidate_summaries(metadata_key, event_types):
+    summary_cache.delete_many([summary_cache_key(metadata_key, et) for et in event_types])
+
+#
+# Cache of time series responses for time ranges that are over, off unless
+# timeseries_cache_backend is configured. The cache keys include the 
+# ps_event_types state of the event type (see get_last_updated()), which 
+# changes whenever data is written to it, so late data for a past time 
+# range is not hidden by a cached response.
+#
+timeseries_cache = caches['timeseries']
+
+class TimeUpdatedRecorder(object):
+    """
+    Write-behind bookkeeping of ps_event_types.time_updated. Updating the 
+    row every time data is written causes a lot of row lock contention when
+    many testers write to the same metadata, so the times are kept in 
+    memory and written out together. Every (metadata key, event type) only
+    keeps its latest time and event types written at the same time end up 
+    in the same UPDATE.
+
+    Pending times are flushed at most max_delay seconds after they were 
+    recorded, which bounds how stale time_updated can get. A max_delay of 0
+    flushes at the end of every request. Anything left is flushed when the
+    process exits.
+    """
+    def __init__(self, max_delay):
+        self.max_delay = max_delay
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def record(self, metadata_key, event_types):
+        # clear out microseconds since timestamp filters are only seconds and we want to allow exact matches
+        updated = current_second()
+        with self.lock:
+            for event_type in event_types:
+                self.pending[(metadata_key, event_type)] = updated
+            if self.max_delay > 0 and self.timer is None:
+                self.timer = threading.Timer(self.max_delay, self._timed_flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if self.max_delay <= 0:
+            self.flush()
+
+    def pending_times(self):
+        """
+        The (metadata key, event type) -> time pairs not written out yet.
+        """
+        with self.lock:
+            return list(self.pending.items())
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            log.error("action=flush_time_updated status=-1 error=%s" % e)
+        finally:
+            # the timer thread has its own db connection, don't leak it
+            connection.close()
+
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not pending:
+            return
+
+        groups = {}
+        for (metadata_key, event_type), updated in list(pending.items()):
+            groups.setdefault((metadata_key, updated), []).append(event_type)
+        try:
+            rawsql_cursor = connection.cursor()
+            with transaction.atomic():
+                for (metadata_key, updated), event_types in sorted(groups.items()):
+                    in_clause = ','.join(['%s'] * len(event_types))
+                    rawsql_cursor.execute("UPDATE ps_event_types SET time_updated=%s WHERE event_type IN (" + in_clause + ") AND metadata_id=(SELECT id FROM ps_metadata WHERE metadata_key=%s)", 
+                        [connection.ops.adapt_datetimefield_value(updated)] + sorted(event_types) + [metadata_key])
+        except:
+            # put back anything that was not recorded again in the meantime
+            with self.lock:
+                for k, updated in list(pending.items()):
+                    self.pending.setdefault(k, updated)
+            raise
+
+time_updated_recorder = TimeUpdatedRecorder(esmond_conf.time_updated_max_delay)
+atexit.register(time_updated_recorder.flush)
+
+#
+# Conditional GET support. The responses of the time series endpoints only
+# change when data or event types are added, which is tracked in 
+# ps_event_types, so the validators can be worked out with a single 
+# aggregate query instead of building the response. The archive endpoint
+# uses its stored documents instead (see ArchiveViewset.list()).
+#
+def get_last_updated(metadata_key=None, event_type=None):
+    """
+    Returns (time_updated, count, max_id) of the ps_event_types rows of 
+    metadata_key (all rows if None), limited to event_type if given. Either
+    can also be a list to get the rows of any of them. The time includes 
+    times not written out by time_updated_recorder yet.
+    """
+    metadata_keys = metadata_key
+    if metadata_keys is not None and not isinstance(metadata_keys, list):
+        metadata_keys = [metadata_keys]
+    event_types = event_type
+    if event_types is not None and not isinstance(event_types, list):
+        event_types = [event_types]
+    qs = PSEventTypes.objects.all()
+    if metadata_keys is not None:
+        qs = qs.filter(metadata__metadata_key__in=metadata_keys)
+    if event_types is not None:
+        qs = qs.filter(event_type__in=event_types)
+    agg = qs.aggregate(time_updated=Max('time_updated'), count=Count('id'), max_id=Max('id'))
+    updated = agg['time_updated']
+    for (k, et), t in time_updated_recorder.pending_times():
+        if (metadata_keys is not None and k not in metadata_keys) or (event_types is not None and et not in event_types):
+            continue
+        if updated is None or t > updated:
+            updated = t
+
+    return updated, agg['count'], agg['max_id']
+
+def current_second():
+    """
+    The current time as an aware datetime, without the microseconds.
+    """
+    return datetime.datetime.utcfromtimestamp(int(time.time())).replace(tzinfo=utc)
+
+def updated_this_second(time_updated):
+    """
+    time_updated is only kept in seconds, so the time series data can still
+    change without time_updated changing until the second it is in is over.
+    Until then no validators or cache keys can be based on it.
+    """
+    return time_updated is not None and time_updated >= current_second()
+
+def relative_time_range(request):
+    """
+    True if the time range of the request is a time-range on its own, so 
+    relative to the current time.
+    """
+    params = request.query_params
+    return TIME_RANGE_FILTER in params and TIME_START_FILTER not in params and TIME_END_FILTER not in params
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha1(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(calendar.timegm(last_modified.utctimetuple()))
+    return response
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Returns a 304 response if the client's copy (If-None-Match or 
+    If-Modified-Since) is current, otherwise None.
+    """
+    if last_modified is not None:
+        last_modified = calendar.timegm(last_modified.utctimetuple())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        return None
+    response['ETag'] = etag
+    return response
+
+#
+# Materialized archive documents. The archive representation of a metadata
+# object needs its subject, event types and parameters, so the JSON is kept
+# in ps_metadata_document (see PSMetadataDocument) and listing only reads
+# and joins it. The URLs in a document depend on the host and path the 
+# request came in on, so everything up to the archive root is stored as a 
+# placeholder that is filled in when the document is served.
+#
+DOCUMENT_URL_ROOT = '{archive-url}'
+DOCUMENT_PATH_ROOT = '{archive-path}'
+
+def archive_roots(request):
+    """
+    Returns the absolute URL and the path of the archive endpoint.
+    """
+    url = reverse('archive-list', request=request)
+    return url, urllib.parse.urlparse(url).path
+
+def encode_document(data, request):
+    """
+    JSON encode the serialized metadata in data for storing, with the
+    URLs made relative to the archive root.
+    """
+    url, path = archive_roots(request)
+    text = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return text.replace('"' + url, '"' + DOCUMENT_URL_ROOT).replace('"' + path, '"' + DOCUMENT_PATH_ROOT)
+
+def decode_document(text, url, path):
+    """
+    The stored document text with the URLs made absolute again given the
+    archive roots of the request (see archive_roots()).
+    """
+    return text.replace('"' + DOCUMENT_URL_ROOT, '"' + url).replace('"' + DOCUMENT_PATH_ROOT, '"' + path)
+
+class HostnameLookupTimeout(APIException):
+    status_code=status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail="Timed out looking up hostname"
+
+class HostnameResolver(object):
+    """
+    Cached hostname lookups for the IP address filters of the archive 
+    search. Addresses are kept for ttl seconds and hosts that don't 
+    resolve for negative_ttl seconds, at most max_hosts of them. Lookups 
+    run in a thread pool so the A and AAAA lookups of a host are done at 
+    the same time and a request can stop waiting on a slow resolver. A 
+    lookup still running when a request gives up on it is shared with 
+    the next request for the same host and cached when it finishes.
+    """
+    def __init__(self, ttl, negative_ttl, max_hosts, threads):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = LRUCache(maxsize=max_hosts)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='dns')
+        self.pending = {}
+        self.lock = threading.RLock()
+
+    def lookup(self, host, families, deadline):
+        """
+        Returns a dict of family (i.e. AF_INET or AF_INET6) to the address
+        of host in that family, or None if it has none. Raises 
+        HostnameLookupTimeout if the lookups aren't done by deadline (a 
+        clock() time), whether they are still running or still waiting for
+        a thread of the pool. None waits for them.
+        """
+        results = {}
+        futures = {}
+        for family in families:
+            key = (host, family)
+            #self as the default tells a cached None apart from a miss
+            addr = self.cache.get(key, self)
+            if addr is not self:
+                results[family] = addr
+            else:
+                futures[family] = self._submit(key)
+        for family, future in list(futures.items()):
+            wait_time = None
+            if deadline is not None:
+                wait_time = max(deadline - self.clock(), 0)
+            try:
+                results[family] = future.result(timeout=wait_time)
+            except FutureTimeoutError:
+                log.warning("action=lookup_hostname status=-1 host=%s error=timeout" % host)
+                raise HostnameLookupTimeout(detail="Timed out looking up host %s" % host)
+        return results
+
+    def clock(self):
+        return time.time()
+
+    def _submit(self, key):
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pool.submit(self._resolve, key)
+                self.pending[key] = future
+                future.add_done_callback(lambda f: self._done(key))
+            return future
+
+    def _done(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def _resolve(self, key):
+        addr = self.resolve(*key)
+        self.cache.set(key, addr, ttl=self.ttl if addr else self.negative_ttl)
+        return addr
+
+    def resolve(self, host, family):
+        """
+        Does a lookup of the IP for host in type family, without the cache.
+        """
+        addr = None
+        addr_info = None
+        try:
+            addr_info = getaddrinfo(host, 80, family, SOCK_STREAM, SOL_TCP)
+        except:
+            pass
+        if addr_info and len(addr_info) >= 1 and len(addr_info[0]) >= 5 and len(addr_info[0][4]) >= 1:
+            addr = addr_info[0][4][0]
+        return addr
+
+hostname_resolver = HostnameResolver(esmond_conf.dns_cache_ttl, esmond_conf.dns_negative_cache_ttl,
+    esmond_conf.dns_cache_size, esmond_conf.dns_lookup_threads)
+
 def check_connection():
     global db
     global EVENT_TYPE_CF_MAP;
@@ -202,20 +565,23 @@ class UtilMixin(object):
 
 class FilterUtilMixin(object):
 
+    def dns_deadline(self):
+        """
+        The time by which all the DNS lookups of this request have to be 
+        done together, dns_lookup_timeout seconds after the first one. 
+        None if there is no limit.
+        """
+        if esmond_conf.dns_lookup_timeout <= 0:
+            return None
+        if getattr(self, '_dns_deadline', None) is None:
+            self._dns_deadline = hostname_resolver.clock() + esmond_conf.dns_lookup_timeout
+        return self._dns_deadline
+
     def lookup_hostname(self, host, family):
         """
         Does a lookup of the IP for host in type family (i.e. AF_INET or AF_INET6)
         """
-        addr = None
-        addr_info = None
-        try:
-            addr_info = getaddrinfo(host, 80, family, SOCK_STREAM, SOL_TCP)
-        except:
-            pass
-        if addr_info and len(addr_info) >= 1 and len(addr_info[0]) >= 5 and len(addr_info[0][4]) >= 1:
-            addr = addr_info[0][4][0]
-        
-        return addr
+        return hostname_resolver.lookup(host, [family], self.dns_deadline())[family]
         
     def prepare_ip(self, host, dns_match_rule):
         """
@@ -223,33 +589,30 @@ class FilterUtilMixin(object):
         it return are dependent on the dns_match_rule. teh default is to return
         both v4 and v6 addresses found. Variations allow one or the other to be
         preferred or even required. If an address is not found a BadRequest is
-        thrown.
+        thrown, if a lookup takes too long a HostnameLookupTimeout.
         """
         #Set default match rule
         if dns_match_rule is None:
             dns_match_rule = DNS_MATCH_V4_V6
         
-        #get IP address
+        #get IP address. the prefer rules look up both at the same time 
+        #rather than waiting for one to fail before trying the other
         addrs = []
-        addr4 = None
-        addr6 = None
         if dns_match_rule == DNS_MATCH_ONLY_V6:
-            addr6 = self.lookup_hostname(host, AF_INET6)
+            families = [AF_INET6]
         elif dns_match_rule == DNS_MATCH_ONLY_V4:
-            addr4 = self.lookup_hostname(host, AF_INET)
-        elif dns_match_rule == DNS_MATCH_PREFER_V6:
-            addr6 = self.lookup_hostname(host, AF_INET6)
-            if addr6 is None:
-                addr4 = self.lookup_hostname(host, AF_INET)
-        elif dns_match_rule == DNS_MATCH_PREFER_V4:
-            addr4 = self.lookup_hostname(host, AF_INET)
-            if addr4 is None:
-                addr6 = self.lookup_hostname(host, AF_INET6)
-        elif dns_match_rule == DNS_MATCH_V4_V6:
-            addr6 = self.lookup_hostname(host, AF_INET6)
-            addr4 = self.lookup_hostname(host, AF_INET)
+            families = [AF_INET]
+        elif dns_match_rule in [DNS_MATCH_PREFER_V6, DNS_MATCH_PREFER_V4, DNS_MATCH_V4_V6]:
+            families = [AF_INET, AF_INET6]
         else:
             raise ParseError(detail="Invalid %s parameter %s" % (DNS_MATCH_RULE_FILTER, dns_match_rule))
+        found = hostname_resolver.lookup(host, families, self.dns_deadline())
+        addr4 = found.get(AF_INET)
+        addr6 = found.get(AF_INET6)
+        if dns_match_rule == DNS_MATCH_PREFER_V6 and addr6:
+            addr4 = None
+        elif dns_match_rule == DNS_MATCH_PREFER_V4 and addr4:
+            addr6 = None
         
         #add results to list
         if addr4: addrs.append(addr4)
@@ -314,11 +677,15 @@ class PSPaginator(pagination.LimitOffsetPagination):
     unmodified response.
     """
     default_limit = 1500
-    
-    ## I actually kinda like the default pagination better
-    ## but sticking with backward compatibility here
-    def get_paginated_response(self, data):
-    
+    # A page is read before its response is started, so it is kept to a 
+    # size that is fine to hold in memory. Longer time series are paged
+    # through.
+    max_limit = 10000
+    # Number of bytes to buffer before handing a chunk of a streamed
+    # response to the server.
+    stream_chunk_size = 65536
+
+    def get_link_header(self):
         #create some pagination links in headers
         next_url = self.get_next_link()
         previous_url = self.get_previous_link()
@@ -331,11 +698,70 @@ class PSPaginator(pagination.LimitOffsetPagination):
         else:
             link = ''
         link = link.format(next_url=next_url, previous_url=previous_url)
-        headers = {'Link': link} if link else {}
-        
+        return {'Link': link} if link else {}
+    
+    ## I actually kinda like the default pagination better
+    ## but sticking with backward compatibility here
+    def get_paginated_response(self, data):
         #return response with unmodified data and links in headers
+        return Response(data, headers=self.get_link_header())
+
+    def paginate_window(self, request, limit, offset, has_next):
+        """
+        Set up the paginator state for a result set that is never 
+        materialized as a list - the caller has already applied limit
+        and offset and just tells us if there is anything past the 
+        current page, which is all the links need.
+        """
+        self.request = request
+        self.limit = limit
+        self.offset = offset
+        self.count = offset + limit + (1 if has_next else 0)
+
+    def get_streaming_response(self, data, links=True):
+        """
+        Like get_paginated_response() but data is an iterable of serialized
+        items that are JSON encoded and written out in chunks as they are 
+        generated, so the whole result set is never held in memory. The 
+        pagination links are left out if links is False, ie: when the 
+        results were not paginated with paginate_window().
+        """
+        response = StreamingHttpResponse(self._stream_json_list(data),
+            content_type='application/json')
+        if links:
+            for k, v in list(self.get_link_header().items()):
+                response[k] = v
+        return response
+
+    def get_cursor_response(self, data, request, next_cursor):
+        """
+        Response for a page of cursor based pagination. Only a next link is
+        given since the cursor only moves forward through the results.
+        """
+        headers = {}
+        if next_cursor is not None:
+            url = remove_query_param(request.build_absolute_uri(), self.offset_query_param)
+            url = replace_query_param(url, CURSOR_FILTER, next_cursor)
+            headers['Link'] = '<{0}>; rel="next"'.format(url)
+
         return Response(data, headers=headers)
 
+    def _stream_json_list(self, data):
+        buf = ['[']
+        size = 1
+        sep = ''
+        for item in data:
+            chunk = sep + json.dumps(item, ensure_ascii=False, separators=(',', ':'))
+            sep = ','
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= self.stream_chunk_size:
+                yield ''.join(buf).encode('utf-8')
+                buf = []
+                size = 0
+        buf.append(']')
+        yield ''.join(buf).encode('utf-8')
+
 class PSMetadataPaginator(PSPaginator):
     """
     Metadata API spec requires us to put pagination details in the first
@@ -345,12 +771,30 @@ class PSMetadataPaginator(PSPaginator):
     def get_paginated_response(self, data):
         
         if len(data) > 0:
-            data[0]['metadata-count-total'] = self.count
-            data[0]['metadata-previous-page'] = self.get_previous_link()
-            data[0]['metadata-next-page'] = self.get_next_link()
+            self.add_page_details(data[0])
             
         return super(PSMetadataPaginator, self).get_paginated_response(data)
 
+    def get_document_response(self, documents):
+        """
+        Like get_paginated_response() but documents are the items already
+        JSON encoded, which are joined together as they are. Only the first
+        one is decoded to add the pagination details.
+        """
+        if documents:
+            first = json.loads(documents[0], object_pairs_hook=collections.OrderedDict)
+            self.add_page_details(first)
+            documents = [json.dumps(first, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))] + documents[1:]
+        response = HttpResponse('[' + ','.join(documents) + ']', content_type='application/json')
+        for k, v in list(self.get_link_header().items()):
+            response[k] = v
+        return response
+
+    def add_page_details(self, item):
+        item['metadata-count-total'] = self.count
+        item['metadata-previous-page'] = self.get_previous_link()
+        item['metadata-next-page'] = self.get_next_link()
+
 class IpAuth(BaseAuthentication):
     def authenticate(self, request):
         #if using proxy use X_FORWARDED_FOR header, else get remote IP
@@ -434,47 +878,89 @@ class PSTimeSeriesObject(object):
         return datetime.datetime.utcfromtimestamp(float(self.time))
     
     def save(self):
+        PSTimeSeriesObject.save_bulk(self.metadata_key, [self])
+
+    @staticmethod
+    def save_bulk(metadata_key, ts_objs):
+        """
+        Store a list of PSTimeSeriesObjects that all belong to the metadata 
+        with key metadata_key. Everything is validated and checked for 
+        conflicts before anything is written, and the per request work is 
+        only done once no matter how many values there are:
+
+        * at most one multiget per column family to make sure the values 
+          do not already exist,
+        * at most one SELECT to get the summaries of the event types (see 
+          get_summaries),
+        * the cassandra mutations are queued up in the batches (the caller 
+          flushes them),
+        * time_updated of all the event types written is recorded in one 
+          go (see TimeUpdatedRecorder).
+        """
         # make sure we have a DB connection, throw exception otherwise
         check_connection()
-        #verify object does not already exist
-        if EVENT_TYPE_CF_MAP[EVENT_TYPE_CONFIG[self.event_type]["type"]] != db.raw_cf:
-            existing = PSTimeSeriesObject.query_database(self.metadata_key, self.event_type, 'base', None, int(self.time), int(self.time), 1)
-            if(len(existing) > 0):
-                raise ConflictException(detail="Time series value already exists with event type %s at time %d" % (self.event_type, int(self.time)))
+
+        #validate data before anything is written. this is the only time
+        #the values are validated, the validated value is what is written
+        for obj in ts_objs:
+            if obj.event_type not in EVENT_TYPE_CONFIG:
+                raise ParseError(detail="Invalid event type %s" % obj.event_type)
+            obj.value = TYPE_VALIDATOR_MAP[EVENT_TYPE_CONFIG[obj.event_type]["type"]].validate(obj)
+
+        #verify objects do not already exist, including twice in this request
+        columns_by_cf = {}
+        written = {}
+        for obj in ts_objs:
+            col_fam = EVENT_TYPE_CF_MAP[EVENT_TYPE_CONFIG[obj.event_type]["type"]]
+            if col_fam == db.raw_cf:
+                continue
+            row_key = get_rowkey(obj.datapath, year=obj.get_datetime().year)
+            col = int(obj.time)*1000
+            if (row_key, col) in written:
+                raise ConflictException(detail="Time series value already exists with event type %s at time %d" % (obj.event_type, int(obj.time)))
+            written[(row_key, col)] = obj
+            columns_by_cf.setdefault(col_fam, {}).setdefault(row_key, []).append(col)
+        for col_fam, columns_by_key in list(columns_by_cf.items()):
+            existing = db.get_existing_columns(cf_map_key(col_fam), columns_by_key)
+            for row_key, cols in list(existing.items()):
+                obj = written[(row_key, min(cols))]
+                raise ConflictException(detail="Time series value already exists with event type %s at time %d" % (obj.event_type, int(obj.time)))
 
         #Insert into cassandra
-        local_cache = {}
-        #NOTE: Ordering in model allows statistics to go last. If this ever changes may need to update code here.
-        #check that this event_type is defined
-        rawsql_cursor = connection.cursor()
-        with transaction.atomic():
-            rawsql_cursor.execute("SELECT summary_type, summary_window FROM ps_event_types WHERE event_type=%s AND metadata_id=(SELECT id FROM ps_metadata WHERE metadata_key=%s) ORDER BY summary_type", [self.event_type, self.metadata_key])
-            for et in rawsql_cursor.fetchall():
-                ts_obj = PSTimeSeriesObject(self.time,
-                                                self.value,
-                                                self.metadata_key,
-                                                event_type=self.event_type,
-                                                summary_type=et[0],
-                                                summary_window=et[1]
+        event_types = sorted(set(obj.event_type for obj in ts_objs))
+        if not event_types:
+            return
+        summaries = get_summaries(metadata_key, event_types)
+        for obj in ts_objs:
+            local_cache = {}
+            for summary_type, summary_window in summaries.get(obj.event_type, []):
+                #the summaries can modify the value, so each gets its own
+                ts_obj = PSTimeSeriesObject(obj.time,
+                                                copy.copy(obj.value),
+                                                metadata_key,
+                                                event_type=obj.event_type,
+                                                summary_type=summary_type,
+                                                summary_window=summary_window
                                                 )
-                self.database_write(ts_obj, local_cache)
-            #make sqlite happy (mainly for unit tests not configured to use postgres)
-            if connection.vendor.startswith('sqlite'):
-                rawsql_cursor.execute("UPDATE ps_event_types SET time_updated='now' WHERE event_type=%s AND metadata_id=(SELECT id FROM ps_metadata WHERE metadata_key=%s)", [self.event_type, self.metadata_key])
-            else:
-                #update time. clear out microseconds since timestamp filters are only seconds and we want to allow exact matches
-                rawsql_cursor.execute("UPDATE ps_event_types SET time_updated=now() WHERE event_type=%s AND metadata_id=(SELECT id FROM ps_metadata WHERE metadata_key=%s)", [self.event_type, self.metadata_key])
+                obj.database_write(ts_obj, local_cache)
+
+        time_updated_recorder.record(metadata_key, [et for et in event_types if summaries[et]])
     
     @staticmethod
     def row_prefix(event_type):
         return ['ps', event_type.replace('-', '_') ]
     
     @staticmethod
-    def query_database(metadata_key, event_type, summary_type, freq, begin_time, end_time, max_results):
+    def _query_args(metadata_key, event_type, summary_type, freq, begin_time, end_time, column_start=None):
+        """
+        Work out the column family and the path/freq/time range arguments
+        shared by the query and count methods below. If column_start (in 
+        milliseconds) is given the range starts there instead of at 
+        begin_time - this is how a pagination cursor resumes a query.
+        """
         # make sure we have a DB connection, throw exception otherwise
         check_connection()
         
-        results = []
         datapath = PSTimeSeriesObject.row_prefix(event_type)
         datapath.append(metadata_key)
         if(summary_type != 'base'):
@@ -491,6 +977,8 @@ class PSTimeSeriesObject(object):
         if freq:
             freq = int(freq)
         begin_millis = begin_time*1000
+        if column_start is not None:
+            begin_millis = max(begin_millis, column_start)
         end_millis = None
         if end_time is None:
             # we need a value here so we know what years to look at when we get row keys
@@ -502,22 +990,71 @@ class PSTimeSeriesObject(object):
         log.debug("action=query_timeseries.start md_key=%s event_type=%s summ_type=%s summ_win=%s start=%s end=%s start_millis=%s end_millis=%s cf=%s datapath=%s" %
                   (metadata_key, event_type, summary_type, freq, begin_time, end_time, begin_millis, end_millis, col_fam, datapath))
 
+        return col_fam, dict(path=datapath, freq=freq, ts_min=begin_millis, ts_max=end_millis)
+
+    @staticmethod
+    def iter_database(metadata_key, event_type, summary_type, freq, begin_time, end_time, max_results, column_start=None):
+        """
+        Returns a generator over the results so they can be streamed to 
+        the client as they are read from cassandra.
+        """
+        col_fam, query_args = PSTimeSeriesObject._query_args(metadata_key, 
+            event_type, summary_type, freq, begin_time, end_time, column_start)
+
         if col_fam == db.agg_cf:
-            results = db.query_aggregation_timerange(path=datapath, freq=freq,
-                   cf='average', ts_min=begin_millis, ts_max=end_millis, column_count=max_results)
+            return db.iter_aggregation_timerange(cf='average', column_count=max_results, **query_args)
         elif col_fam == db.rate_cf:
-            results = db.query_baserate_timerange(path=datapath, freq=freq,
-                    cf='delta', ts_min=begin_millis, ts_max=end_millis, column_count=max_results)
+            return db.iter_baserate_timerange(cf='delta', column_count=max_results, **query_args)
         elif col_fam == db.raw_cf:
-            results = db.query_raw_data(path=datapath, freq=freq,
-                   ts_min=begin_millis, ts_max=end_millis, column_count=max_results)
+            return db.iter_raw_data(column_count=max_results, **query_args)
         else:
             log.debug("action=query_timeseries.end status=-1")
             raise ParseError(detail="Requested data does not map to a known column-family")
 
-        return results
+    @staticmethod
+    def query_database(metadata_key, event_type, summary_type, freq, begin_time, end_time, max_results):
+        return list(PSTimeSeriesObject.iter_database(metadata_key, event_type, 
+            summary_type, freq, begin_time, end_time, max_results))
+
+    @staticmethod
+    def iter_database_bulk(queries, begin_time, end_time, max_results, chunk_size=None):
+        """
+        Bulk version of iter_database(). The queries arg is a list of 
+        (metadata_key, event_type, summary_type, freq) tuples that are read
+        from cassandra together, chunk_size at a time. Returns a generator 
+        over the results of each query, in the same order.
+        """
+        db_queries = []
+        ts_min = ts_max = None
+        for metadata_key, event_type, summary_type, freq in queries:
+            col_fam, query_args = PSTimeSeriesObject._query_args(metadata_key, 
+                event_type, summary_type, freq, begin_time, end_time)
+            if col_fam == db.agg_cf:
+                cf = 'agg_average'
+            elif col_fam == db.rate_cf:
+                cf = 'delta'
+            elif col_fam == db.raw_cf:
+                cf = 'raw'
+            else:
+                log.debug("action=query_timeseries.end status=-1")
+                raise ParseError(detail="Requested data does not map to a known column-family")
+            db_queries.append((query_args['path'], query_args['freq'], cf))
+            ts_min = query_args['ts_min']
+            ts_max = max(ts_max or 0, query_args['ts_max'])
+
+        return db.iter_timerange_bulk(db_queries, ts_min=ts_min, ts_max=ts_max,
+            column_count=max_results, chunk_size=chunk_size)
+
+    @staticmethod
+    def query_database_bulk(queries, begin_time, end_time, max_results):
+        return list(PSTimeSeriesObject.iter_database_bulk(queries, begin_time, 
+            end_time, max_results))
 
     def database_write(self, ts_obj, local_cache):
+        """
+        Write a summary of a value. The value has already been validated 
+        by save_bulk().
+        """
         # make sure we have a DB connection, throw exception otherwise
         check_connection()
         
@@ -529,9 +1066,6 @@ class PSTimeSeriesObject(object):
             #skip invalid summary. should do logging here
             return
         
-        #validate data
-        ts_obj.value = validator.validate(ts_obj)
-        
         #Determine column family
         col_family = validator.summary_cf(db, ts_obj.summary_type)
         if col_family is None:
@@ -693,7 +1227,11 @@ class ArchiveSerializer(UtilMixin, serializers.ModelSerializer):
         # check if exists. just return existing if it does
         existing_md = PSMetadata.objects.filter(checksum=validated_data["checksum"])
         if existing_md.count() > 0:
-            return existing_md[0]
+            metadata = existing_md[0]
+            #make sure it can be found, testers post their metadata again
+            #until it is
+            index_metadata_if_missing(metadata)
+            return metadata
         
         #pop objects we create separately.
         subject_model = SUBJECT_MODEL_MAP[validated_data['subject_type']]
@@ -701,19 +1239,27 @@ class ArchiveSerializer(UtilMixin, serializers.ModelSerializer):
         event_types= validated_data.pop('pseventtypes')
         md_params= validated_data.pop('psmetadataparameters')
         
-        #store metadata object and subjects
-        metadata = PSMetadata.objects.create(**validated_data)
-        
-        #store subject. this depends on the subject type so do some dynamic lookups
-        self.get_fields()[subject_model].Meta.model.objects.create(metadata=metadata, **subject)
-        
-        #store event types
-        for event_type in event_types:
-            PSEventTypes.objects.create(metadata=metadata, **event_type)
+        #everything is stored in one transaction so the metadata is never 
+        #seen (ie: listed) without its event types and parameters
+        with transaction.atomic():
+            #store metadata object
+            metadata = PSMetadata.objects.create(**validated_data)
+            
+            #store event types
+            for event_type in event_types:
+                PSEventTypes.objects.create(metadata=metadata, **event_type)
+            
+            #store parameters. in one go, saving them one by one would 
+            #index the metadata again for each
+            PSMetadataParameters.objects.bulk_create([
+                PSMetadataParameters(metadata=metadata, **md_param) for md_param in md_params])
+            
+            #store subject. this depends on the subject type so do some dynamic lookups.
+            #saving it makes the metadata searchable (see index_metadata_search)
+            self.get_fields()[subject_model].Meta.model.objects.create(metadata=metadata, **subject)
         
-        #store parameters
-        for md_param in md_params:
-            PSMetadataParameters.objects.create(metadata=metadata, **md_param)
+        #drop anything cached while the metadata did not exist yet
+        invalidate_summaries(metadata.metadata_key, set(et['event_type'] for et in event_types))
         
         return metadata
     
@@ -806,90 +1352,152 @@ class ArchiveViewset(mixins.CreateModelMixin,
         1. Make sure event type parameters match the same event type object
         2. Apply the free-form metadata parameter filters also making sure they match the same row
         3. Create an OR condition between different subject types with same name
+
+        Subject and parameter filters are looked up in the metadata search
+        index (see esmond.api.perfsonar.search) and the event type filters
+        in one subquery on ps_event_types, so each filter only narrows down
+        the metadata ids and nothing is joined to ps_metadata.
         """
         
         ret = PSMetadata.objects.all()
-        metadata_only_filters = {}
-        subject_qs = []
+        search_qs = []
         event_type_qs = []
-        parameter_qs = []
         #we need to make sure we have this before processing IP values
         dns_match_rule = self.request.query_params.get(DNS_MATCH_RULE_FILTER, None)
         
-        #Convert get parameters to Django model filters
+        #Convert get parameters to search index and event type filters
         for filter in self.request.query_params:
             filter_val = self.request.query_params.get(filter)
             
             #Determine type of filter
             if filter in SUBJECT_FILTER_MAP:
-                # map subject to subject field
-                subject_q = None
-                for subject_db_field in SUBJECT_FILTER_MAP[filter]:
-                    tmp_filters = {}
-                    if filter in IP_FIELDS:
-                        ip_val = self.prepare_ip(filter_val, dns_match_rule)
-                        filter_key = "%s__in" % subject_db_field
-                        tmp_filters[filter_key] = ip_val
-                    else:
-                        tmp_filters[subject_db_field] = filter_val
-                    
-                    if(subject_q is None):
-                        subject_q = Q(**tmp_filters)
-                    else:
-                        subject_q = subject_q | Q(**tmp_filters)
-                if(subject_q is not None):
-                    subject_qs.append(subject_q)
+                # subject fields are indexed under the filter name for all subject types
+                if filter in IP_FIELDS:
+                    search_qs.append(search_filter(SEARCH_KIND_SUBJECT, filter, self.prepare_ip(filter_val, dns_match_rule)))
+                else:
+                    search_qs.append(search_filter(SEARCH_KIND_SUBJECT, filter, [filter_val]))
             elif filter == EVENT_TYPE_FILTER:
-                event_type_qs.append(Q(pseventtypes__event_type=filter_val))
+                event_type_qs.append(Q(event_type=filter_val))
             elif filter == SUMMARY_TYPE_FILTER:
-                event_type_qs.append(Q(pseventtypes__summary_type=filter_val))
+                event_type_qs.append(Q(summary_type=filter_val))
             elif filter == SUMMARY_WINDOW_FILTER:
-                event_type_qs.append(Q(pseventtypes__summary_window=filter_val))            
+                event_type_qs.append(Q(summary_window=filter_val))            
             elif filter == SUBJECT_TYPE_FILTER:
                 ret = ret.filter(subject_type=filter_val)
             elif filter == METADATA_KEY_FILTER:
                 ret = ret.filter(metadata_key=filter_val)
             elif filter not in RESERVED_GET_PARAMS:
                 if filter in IP_FIELDS:
-                    ip_val = self.prepare_ip(filter_val, dns_match_rule)
-                    # map to ps_metadata_parameters
-                    parameter_qs.append(Q(
-                        psmetadataparameters__parameter_key=filter,
-                        psmetadataparameters__parameter_value__in=ip_val))
+                    search_qs.append(search_filter(SEARCH_KIND_PARAMETER, filter, self.prepare_ip(filter_val, dns_match_rule)))
                 else:
-                    # map to ps_metadata_parameters
-                    parameter_qs.append(Q(
-                    psmetadataparameters__parameter_key=filter,
-                    psmetadataparameters__parameter_value=filter_val))
+                    search_qs.append(search_filter(SEARCH_KIND_PARAMETER, filter, [filter_val]))
         
         #add time filters if there are any
         time_filters = self.handle_time_filters(self.request.query_params)
         if(time_filters["has_filters"]):
             #print "begin_ts=%d, end_ts=%d" % (time_filters['begin'], time_filters['end'])
             begin = datetime.datetime.utcfromtimestamp(time_filters['begin']).replace(tzinfo=utc)
-            event_type_qs.append(Q(pseventtypes__time_updated__gte=begin))
+            event_type_qs.append(Q(time_updated__gte=begin))
             if time_filters['end'] is not None:
                 end = datetime.datetime.utcfromtimestamp(time_filters['end']).replace(tzinfo=utc)
-                event_type_qs.append(Q(pseventtypes__time_updated__lte=end))
+                event_type_qs.append(Q(time_updated__lte=end))
             
-        #apply filters. this is done down here to ensure proper grouping
+        #apply filters. the event type filters all go in the same subquery
+        #so they have to match the same event type row
         if event_type_qs:
-            ret = ret.filter(*event_type_qs)
-        for parameter_q in parameter_qs:
-            ret = ret.filter(parameter_q)
-        for subject_q in subject_qs:
-            ret = ret.filter(subject_q)
+            ret = ret.filter(id__in=PSEventTypes.objects.filter(*event_type_qs).values('metadata_id'))
+        if search_qs:
+            ret = ret.filter(*search_qs)
         
-        return ret.distinct()
+        #fetch the subjects and stored documents with the metadata. the event 
+        #types and parameters are only needed to build missing documents, 
+        #see page_documents()
+        return ret.select_related('document', *list(SUBJECT_MODEL_MAP.values()))
 
     def list(self, request):
         """Stub for list GET ie:
 
         GET /perfsonar/archive/
 
-        Probably won't need modification, just here for reference.
+        Responses carry an ETag for conditional GETs. The ETag is a digest
+        of the stored documents of the page and the total count, so it 
+        changes with anything in the response, including subjects and 
+        parameters edited in the admin.
+        """
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        documents = self.page_documents(request, page)
+        etag = make_etag(request.get_full_path(), self.paginator.count, documents)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        return set_validators(self.document_response(request, documents), etag)
+
+    def page_documents(self, request, page):
+        """
+        The stored documents of the metadata objects of the page, with the 
+        URLs still encoded. The documents of any that don't have one yet, 
+        or whose event types have changed since it was built, are built 
+        with the serializer and stored, fetching the event types and 
+        parameters of all of them at once. Checking the event types when 
+        listing means a document built while they were being updated can't
+        stay stale.
+        """
+        versions = dict((v['metadata_id'], (v['time_updated'], v['count'])) for v in
+            PSEventTypes.objects.filter(metadata_id__in=[obj.id for obj in page]).order_by()
+                .values('metadata_id').annotate(time_updated=Max('time_updated'), count=Count('id')))
+        missing = []
+        stale = []
+        for obj in page:
+            try:
+                doc = obj.document
+            except PSMetadataDocument.DoesNotExist:
+                missing.append(obj)
+                continue
+            if (doc.time_updated, doc.event_type_count) != versions.get(obj.id, (None, 0)):
+                missing.append(obj)
+                stale.append(obj.id)
+        if missing:
+            prefetch_related_objects(missing, 'pseventtypes', 'psmetadataparameters')
+            new_docs = [self.build_document(obj, request) for obj in missing]
+            try:
+                with transaction.atomic():
+                    if stale:
+                        PSMetadataDocument.objects.filter(metadata_id__in=stale).delete()
+                    PSMetadataDocument.objects.bulk_create(new_docs)
+            except IntegrityError:
+                # another request stored them first, if they're stale they
+                # are built again next time
+                pass
+            for obj, doc in zip(missing, new_docs):
+                obj.document = doc
+
+        return [obj.document.document for obj in page]
+
+    def document_response(self, request, documents):
         """
-        return super(ArchiveViewset, self).list(request)
+        Lists the documents (from page_documents()) with their URLs filled 
+        in for the request.
+        """
+        url, path = archive_roots(request)
+        documents = [decode_document(d, url, path) for d in documents]
+        if request.accepted_renderer.format != 'json':
+            # e.g. the browsable API, which needs the data
+            return self.get_paginated_response([json.loads(d, object_pairs_hook=collections.OrderedDict) for d in documents])
+        return self.paginator.get_document_response(documents)
+
+    def build_document(self, obj, request):
+        """
+        The PSMetadataDocument of obj, which has its event types and 
+        parameters prefetched. The version is taken from the event types 
+        the document is built from.
+        """
+        event_types = obj.pseventtypes.all()
+        times = [et.time_updated for et in event_types if et.time_updated is not None]
+        return PSMetadataDocument(metadata=obj, 
+            document=encode_document(self.get_serializer(obj).data, request),
+            time_updated=max(times) if times else None,
+            event_type_count=len(event_types))
 
     def retrieve(self, request, **kwargs):
         """Stub for detail GET 'metadata_key', will be one of 
@@ -898,9 +1506,16 @@ class ArchiveViewset(mixins.CreateModelMixin,
 
         /GET perfsonar/archive/$METADATA_KEY/
 
-        Probably won't need modification, just here for reference.
+        Responses carry an ETag for conditional GETs, a digest of the 
+        stored document of the metadata (see list()).
         """
-        return super(ArchiveViewset, self).retrieve(request, **kwargs)
+        instance = self.get_object()
+        etag = make_etag(request.get_full_path(), self.page_documents(request, [instance]))
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        return set_validators(Response(self.get_serializer(instance).data), etag)
 
     def create(self, request):
         """Stub for POST metadata object creation - ie:
@@ -944,6 +1559,7 @@ class ArchiveViewset(mixins.CreateModelMixin,
         
         #validate 
         i = 0
+        ts_objs = []
         for ts_item in request_data["data"]:
             i += 1
             if DATA_KEY_TIME not in ts_item:
@@ -960,10 +1576,12 @@ class ArchiveViewset(mixins.CreateModelMixin,
                     raise ParseError(detail="Missing event-type field at data item %d in value %d " % (i, j))
                 if DATA_KEY_VALUE not in val_item:
                     raise ParseError(detail="Missing %s field at data item %d in value %d " % (DATA_KEY_VALUE, i, j))
-                tmp_obj = { DATA_KEY_TIME: ts, DATA_KEY_VALUE: val_item[DATA_KEY_VALUE] }
                 obj = PSTimeSeriesObject(ts, val_item[DATA_KEY_VALUE], kwargs["metadata_key"])
                 obj.event_type =  val_item['event-type']
-                obj.save()
+                ts_objs.append(obj)
+        
+        #store everything in one go
+        PSTimeSeriesObject.save_bulk(kwargs["metadata_key"], ts_objs)
                 
         #everything succeeded so save to database
         db.flush()
@@ -1086,6 +1704,10 @@ class TimeSeriesViewset(UtilMixin, FilterUtilMixin, ViewsetBase):
     queryset = _get_ersatz_esmond_api_queryset('timeseries')
     serializer_class = TimeSeriesSerializer # mollify viewset
     pagination_class = PSPaginator
+    # Limit on the metadata keys times event types of a bulk request
+    max_bulk_series = 500
+    # Number of time series of a bulk request read from cassandra at a time
+    bulk_chunk_size = 50
 
     def retrieve(self, request, **kwargs):
         """
@@ -1130,25 +1752,281 @@ class TimeSeriesViewset(UtilMixin, FilterUtilMixin, ViewsetBase):
         begin_time = time_result['begin']
         end_time = time_result['end']
         
-        #Handle pagination
-        ##set high limit by default. This is a performance gain so pycassa doesn't have to count
-        max_results = 1000000 
-        #if specified, make sure we grab enough results so can handle offset
-        if LIMIT_FILTER in request.query_params:
-            max_results = int(request.query_params[LIMIT_FILTER])
-            if OFFSET_FILTER in request.query_params:
-                max_results += int(request.query_params[OFFSET_FILTER])
+        #Conditional GET, answered before going anywhere near cassandra
+        last_updated = get_last_updated(metadata_key, event_type)
+        etag, last_modified = self.response_validators(request, last_updated, begin_time, end_time)
+        if etag is not None:
+            response = not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
+        
+        #Time ranges that are over don't change so the response can be cached
+        cache_key = self.response_cache_key(request, metadata_key, event_type, summary_type, freq, last_updated, begin_time, end_time)
+        if cache_key is not None:
+            response = self.cached_response(request, cache_key, lambda: self.query_response(request, metadata_key, event_type, summary_type, freq, begin_time, end_time))
+        else:
+            response = self.query_response(request, metadata_key, event_type, summary_type, freq, begin_time, end_time)
+        
+        if etag is not None:
+            set_validators(response, etag, last_modified)
+        return response
+
+    def query_response(self, request, metadata_key, event_type, summary_type, freq, begin_time, end_time):
+        """
+        Run the query for GET requests for timeseries data once the URL and
+        time filters have been checked.
+        """
+        #Statistics over the whole time range instead of the data itself
+        if PERCENTILES_FILTER in request.query_params:
+            return self.percentile_summary(request, metadata_key, event_type, summary_type, freq, begin_time, end_time)
+        
+        #Downsampled data covers the whole time range, no pagination
+        if MAX_POINTS_FILTER in request.query_params:
+            return self.downsampled(request, metadata_key, event_type, summary_type, freq, begin_time, end_time)
+        
+        #Cursor pagination is handled separately from limit/offset
+        if CURSOR_FILTER in request.query_params:
+            return self.cursor_page(request, metadata_key, event_type, summary_type, freq, begin_time, end_time)
+
+        #Handle pagination. The limit and offset are pushed down into the
+        #column slice so only the requested page is read from cassandra. The
+        #links go in the headers, so the page (at most max_limit values) is 
+        #read before the response is started and a look at the value after
+        #it tells us if there is a next page. Serializing and encoding the 
+        #values is left to the stream.
+        limit = self.paginator.get_limit(request)
+        offset = self.paginator.get_offset(request)
+        results = PSTimeSeriesObject.iter_database(metadata_key, event_type, summary_type, freq, begin_time, end_time, offset + limit + 1)
+        page = list(itertools.islice(results, offset, offset + limit))
+        self.paginator.paginate_window(request, limit, offset, next(results, None) is not None)
                 
-        #send query
-        results = PSTimeSeriesObject.query_database(metadata_key, event_type, summary_type, freq, begin_time, end_time, max_results)
         #serialize result
-        data = self.serializer_class(results, many=True).data
-        #paginate result
-        data = self.paginator.paginate_queryset(data, self.request, view=self)
+        serializer = self.get_serializer()
+        data = (serializer.to_representation(r) for r in page)
         
+        #plain json is streamed straight out, other renderers (ie: the 
+        #browsable api) get a regular response.
+        if request.accepted_renderer.format == 'json':
+            return self.paginator.get_streaming_response(data)
+
         #return response with pagination headers set
-        return self.paginator.get_paginated_response(data)
+        return self.paginator.get_paginated_response(list(data))
+
+    def response_validators(self, request, last_updated, begin_time, end_time):
+        """
+        Returns the ETag and Last-Modified time of the response, None for 
+        both if there can't be any. The data only changes when it is written
+        to, which updates time_updated of the event type (last_updated is 
+        from get_last_updated()). A time-range on its own is relative to the
+        current time, so then the time range is part of the ETag too and 
+        there is no Last-Modified time since the data can change without 
+        being written to.
+        """
+        time_updated, count, max_id = last_updated
+        if updated_this_second(time_updated):
+            return None, None
+        parts = [request.get_full_path(), time_updated, count, max_id]
+        if relative_time_range(request):
+            parts.extend([begin_time, end_time])
+            time_updated = None
+
+        return make_etag(*parts), time_updated
+
+    def response_cache_key(self, request, metadata_key, event_type, summary_type, freq, last_updated, begin_time, end_time):
+        """
+        Returns the key to cache the response under, or None if it should 
+        not be cached: the cache has to be configured, the time range has to
+        have ended timeseries_cache_settle seconds ago, so no more data is 
+        expected for it, and only plain json is cached.
+
+        The key includes last_updated (from get_last_updated()) so it 
+        changes when data is written, and nothing is cached until the 
+        second of the last write is over (see updated_this_second()). The
+        cached Link header is built from the scheme, host and parameters 
+        of the request, so they are all part of the key.
+        """
+        if not esmond_conf.timeseries_cache_backend or not esmond_conf.timeseries_cache_ttl:
+            return None
+        if end_time is None or end_time > time.time() - esmond_conf.timeseries_cache_settle:
+            return None
+        if request.accepted_renderer.format != 'json':
+            return None
+        if updated_this_second(last_updated[0]):
+            return None
+        #the other parameters (ie: limit, max-points) change the response too
+        params = sorted((k, request.query_params.getlist(k)) for k in request.query_params)
+        key = json.dumps([request.scheme, request.get_host(), metadata_key, event_type, summary_type, freq, 
+                          begin_time, end_time, params, last_updated], default=str)
+
+        return 'ps_timeseries:%s' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def cached_response(self, request, cache_key, query):
+        """
+        Return the cached response for cache_key, running query() to get 
+        and cache it if needed.
+        """
+        cached = timeseries_cache.get(cache_key)
+        if cached is None:
+            response = query()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            if isinstance(response, StreamingHttpResponse):
+                body = b''.join(response.streaming_content)
+            else:
+                body = JSONRenderer().render(response.data)
+            cached = {
+                'body': body,
+                'headers': dict((h, response[h]) for h in ['Link'] if response.has_header(h)),
+            }
+            timeseries_cache.set(cache_key, cached, esmond_conf.timeseries_cache_ttl)
+
+        response = HttpResponse(cached['body'], content_type='application/json')
+        for h, v in list(cached['headers'].items()):
+            response[h] = v
+
+        return response
+
+    def cursor_page(self, request, metadata_key, event_type, summary_type, freq, begin_time, end_time):
+        """
+        Return one page of results for cursor based pagination. The cursor is
+        the column (timestamp in milliseconds) the page starts from, so each 
+        page is a single slice from that point no matter how deep into the 
+        results the client is. An empty cursor starts at the beginning of the
+        time range. The Link header carries the cursor for the next page.
+        """
+        column_start = None
+        cursor = request.query_params[CURSOR_FILTER]
+        if cursor:
+            column_start = self.valid_cursor(cursor)
+        limit = self.paginator.get_limit(request)
+
+        #read one past the page to see if there is a next one
+        results = list(PSTimeSeriesObject.iter_database(metadata_key, event_type, summary_type, freq, begin_time, end_time, limit + 1, column_start))
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = results[-1]['ts'] + 1
+
+        serializer = self.get_serializer()
+        data = [serializer.to_representation(r) for r in results]
+
+        return self.paginator.get_cursor_response(data, request, next_cursor)
+
+    def percentile_summary(self, request, metadata_key, event_type, summary_type, freq, begin_time, end_time):
+        """
+        Merge all the histograms in the time range and return the statistics
+        of the result, including the percentiles given as a comma separated 
+        list (ie: percentiles=99,99.9). An empty list gets the percentiles 
+        stored in the statistics summary. The result is a single value with 
+        the time of the first histogram, or nothing if there is no data.
+        """
+        if EVENT_TYPE_CONFIG[event_type]["type"] != "histogram" or summary_type not in ['base', 'aggregations']:
+            raise ParseError(detail="The %s parameter is only supported for base and aggregation histograms" % PERCENTILES_FILTER)
+        quantiles = self.valid_percentiles(request.query_params[PERCENTILES_FILTER])
+
+        first_ts = None
+        merged = {}
+        for r in PSTimeSeriesObject.iter_database(metadata_key, event_type, summary_type, freq, begin_time, end_time, None):
+            if first_ts is None:
+                first_ts = r['ts']
+            for k in r['val']:
+                merged[k] = merged.get(k, 0) + r['val'][k]
+        if first_ts is None:
+            return Response([])
+
+        stats = {}
+        if sum(merged.values()) > 0:
+            stats = histogram_statistics(merged, quantiles)
+        serializer = self.get_serializer()
+
+        return Response([serializer.to_representation({'ts': first_ts, 'val': stats})])
+
+    def downsampled(self, request, metadata_key, event_type, summary_type, freq, begin_time, end_time):
+        """
+        Return the numeric data in the time range reduced to no more than
+        max-points points. The range is split into equal time buckets and 
+        each is reduced with the function given by the reduce parameter 
+        (average if not given) as the data is streamed from cassandra.
+        Averages of the base data are read from the coarsest stored summary
+        that is fine enough, see resolution_summary().
+        """
+        if EVENT_TYPE_CONFIG[event_type]["type"] not in ['float', 'integer', 'percentage'] or summary_type == 'statistics':
+            raise ParseError(detail="The %s parameter is only supported for numeric data" % MAX_POINTS_FILTER)
+        max_points = self.valid_max_points(request.query_params[MAX_POINTS_FILTER])
+        reduce = request.query_params.get(REDUCE_FILTER, 'average')
+        if reduce not in REDUCE_FUNCTIONS:
+            raise ParseError(detail="Invalid %s parameter %s" % (REDUCE_FILTER, reduce))
+        if reduce == 'lttb' and max_points < 3:
+            raise ParseError(detail="The %s parameter must be at least 3 for lttb" % MAX_POINTS_FILTER)
+        if end_time is None:
+            end_time = int(time.time())
+
+        #Averages can be served from a stored summary instead of the base data
+        if summary_type == 'base' and reduce == 'average':
+            summary_type, freq = self.resolution_summary(metadata_key, event_type, begin_time, end_time, max_points)
+            if freq:
+                #start at the window the range starts in
+                begin_time -= begin_time % int(freq)
+
+        results = PSTimeSeriesObject.iter_database(metadata_key, event_type, summary_type, freq, begin_time, end_time, None)
+        results = downsample(results, begin_time*1000, end_time*1000, max_points, reduce)
+        serializer = self.get_serializer()
+        data = (serializer.to_representation(r) for r in results)
 
+        if request.accepted_renderer.format == 'json':
+            #the whole range is a single page
+            self.paginator.paginate_window(request, max_points, 0, False)
+            return self.paginator.get_streaming_response(data)
+
+        return Response(list(data))
+
+    def resolution_summary(self, metadata_key, event_type, begin_time, end_time, max_points):
+        """
+        Returns the (summary_type, summary_window) to read to get max_points
+        points over the time range: the largest window of the summary in 
+        RESOLUTION_SUMMARIES that is no longer than the buckets the range is
+        split into, or ('base', None) if there is none.
+        """
+        summary = RESOLUTION_SUMMARIES.get(EVENT_TYPE_CONFIG[event_type]["type"])
+        if summary is None:
+            return 'base', None
+        bucket = (end_time - begin_time) / float(max_points)
+        windows = [int(window) for summary_type, window in get_summaries(metadata_key, [event_type])[event_type]
+                   if summary_type == summary and 0 < int(window) <= bucket]
+        if not windows:
+            return 'base', None
+
+        return INVERSE_SUMMARY_TYPES[summary], str(max(windows))
+
+    def valid_max_points(self, max_points):
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            raise ParseError(detail="Invalid %s parameter %s" % (MAX_POINTS_FILTER, max_points))
+        if max_points < 1:
+            raise ParseError(detail="The %s parameter must be greater than 0" % MAX_POINTS_FILTER)
+        return max_points
+
+    def valid_percentiles(self, percentiles):
+        if not percentiles:
+            return DEFAULT_QUANTILES
+        quantiles = []
+        for p in percentiles.split(','):
+            try:
+                p = float(p)
+            except ValueError:
+                raise ParseError(detail="Invalid %s parameter %s" % (PERCENTILES_FILTER, percentiles))
+            if p <= 0 or p >= 100:
+                raise ParseError(detail="Percentiles must be greater than 0 and less than 100")
+            quantiles.append(p)
+        return quantiles
+
+    def valid_cursor(self, cursor):
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            raise ParseError(detail="Invalid %s parameter %s" % (CURSOR_FILTER, cursor))
+        return cursor
 
     def create(self, request, **kwargs):
         """
@@ -1213,6 +2091,96 @@ class TimeSeriesViewset(UtilMixin, FilterUtilMixin, ViewsetBase):
         
         return Response('', status.HTTP_201_CREATED)
 
+    def bulk_retrieve(self, request):
+        """
+        GET request for the timeseries data of several metadata keys and/or
+        event types at once, ie: a dashboard showing a mesh of tests.
+
+        GET /timeseries?metadata-key=$KEY1&metadata-key=$KEY2&event-type=$EVENT_TYPE
+
+        The metadata-key and event-type parameters can be repeated or be 
+        comma separated lists and every combination is returned. The 
+        summary-type (default base) and summary-window parameters and the
+        time filters apply to all of them, the limit to each one. All the 
+        data is read from cassandra in one bulk query.
+        """
+        metadata_keys = self.bulk_param_list(request, METADATA_KEY_FILTER)
+        event_types = self.bulk_param_list(request, EVENT_TYPE_FILTER)
+        if not metadata_keys:
+            raise ParseError(detail="No metadata key specified for data query")
+        if not event_types:
+            raise ParseError(detail="No event type specified for data query")
+        for event_type in event_types:
+            if event_type not in EVENT_TYPE_CONFIG:
+                raise ParseError(detail="Unsupported event type '%s' provided" % event_type)
+        if len(metadata_keys) * len(event_types) > self.max_bulk_series:
+            raise ParseError(detail="No more than %d time series can be requested at once" % self.max_bulk_series)
+        summary_type = request.query_params.get(SUMMARY_TYPE_FILTER, 'base')
+        if summary_type not in SUMMARY_TYPES:
+            raise ParseError(detail="Invalid summary type '%s'" % summary_type)
+        freq = None
+        if SUMMARY_WINDOW_FILTER in request.query_params:
+            freq = self.valid_summary_window(request.query_params[SUMMARY_WINDOW_FILTER])
+        elif summary_type != 'base':
+            raise ParseError(detail="A %s is required for summary type '%s'" % (SUMMARY_WINDOW_FILTER, summary_type))
+
+        time_result = self.handle_time_filters(request.query_params)
+        limit = self.paginator.get_limit(request)
+
+        #Conditional GET, with one aggregate over all the time series
+        etag = self.bulk_etag(request, metadata_keys, event_types, time_result['begin'], time_result['end'])
+        if etag is not None:
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+
+        queries = [(k, et, summary_type, freq) for k in metadata_keys for et in event_types]
+        results = PSTimeSeriesObject.iter_database_bulk(queries, 
+            time_result['begin'], time_result['end'], limit, self.bulk_chunk_size)
+
+        serializer = self.get_serializer()
+        data = ({
+                'metadata-key': metadata_key,
+                'event-type': event_type,
+                'summary-type': summary_type,
+                'summary-window': freq or '0',
+                'data': [serializer.to_representation(v) for v in r],
+            } for (metadata_key, event_type, summary_type, freq), r in zip(queries, results))
+
+        #plain json is streamed out as the chunks are read
+        if request.accepted_renderer.format == 'json':
+            response = self.paginator.get_streaming_response(data, links=False)
+        else:
+            response = Response(list(data))
+
+        if etag is not None:
+            set_validators(response, etag)
+        return response
+
+    def bulk_etag(self, request, metadata_keys, event_types, begin_time, end_time):
+        """
+        ETag of a bulk response, from the last update of all of its time
+        series, or None if there can't be one yet. A time-range on its own
+        is relative to the current time, so then the time range is part of
+        the ETag too.
+        """
+        time_updated, count, max_id = get_last_updated(metadata_keys, event_types)
+        if updated_this_second(time_updated):
+            return None
+        parts = [request.get_full_path(), time_updated, count, max_id]
+        if relative_time_range(request):
+            parts.extend([begin_time, end_time])
+
+        return make_etag(*parts)
+
+    def bulk_param_list(self, request, param):
+        values = []
+        for v in request.query_params.getlist(param):
+            for x in v.split(','):
+                if x and x not in values:
+                    values.append(x)
+        return values
+
     def summary_details(self, request, metadata_key, event_type, summary_type):
         """
         Format response for GET /archive/$METADATA_KEY/$EVENT_TYPE/$SUMMARY_TYPE where 
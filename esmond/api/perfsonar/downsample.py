@@ -0,0 +1,98 @@
+"""
+Server side downsampling of time series data. The time range of a query is
+split into equal time buckets and the points in each bucket are reduced to
+one as they are read, so a graph of a long time range does not need every
+stored value to be sent to the client.
+"""
+
+import itertools
+
+'''
+REDUCE_FUNCTIONS: The ways the points of a bucket can be reduced. average,
+min and max return one point per bucket at the start of the bucket. lttb
+(Largest-Triangle-Three-Buckets) keeps the actual point of each bucket
+that best preserves the shape of the graph, plus the first and last points.
+'''
+REDUCE_FUNCTIONS = ['average', 'min', 'max', 'lttb']
+
+def bucket_width(begin, end, buckets):
+    """
+    Width in milliseconds of the buckets that split the time range from
+    begin to end (in milliseconds) into at most the given number of
+    buckets, rounded up to whole seconds.
+    """
+    span = max(end - begin, 0) + 1
+    width = -(-span // buckets)
+    return -(-width // 1000) * 1000
+
+def downsample(points, begin, end, max_points, reduce='average'):
+    """
+    Generator that reduces points (an iterable of dicts with 'ts' in
+    milliseconds and a numeric 'val', in time order) from the time range
+    begin to end (in milliseconds) to no more than max_points points. Only
+    the points of one bucket are held in memory at a time. Points without
+    a value are skipped.
+    """
+    if reduce == 'lttb':
+        # the first and last points take up a point each
+        width = bucket_width(begin, end, max(max_points - 2, 1))
+    else:
+        width = bucket_width(begin, end, max_points)
+
+    points = ((p['ts'], p['val']) for p in points if p['val'] is not None)
+    buckets = itertools.groupby(points, lambda p: (p[0] - begin) // width)
+
+    if reduce == 'lttb':
+        for p in _lttb(buckets):
+            yield {'ts': p[0], 'val': p[1]}
+        return
+
+    for i, bucket in buckets:
+        ts = begin + i * width
+        if reduce == 'min':
+            val = min(v for t, v in bucket)
+        elif reduce == 'max':
+            val = max(v for t, v in bucket)
+        else:
+            total = 0
+            count = 0
+            for t, v in bucket:
+                total += v
+                count += 1
+            val = total / float(count)
+        yield {'ts': ts, 'val': val}
+
+def _lttb(buckets):
+    """
+    Largest-Triangle-Three-Buckets over (bucket number, points) groups.
+    From each bucket the point that forms the largest triangle with the
+    point chosen from the previous bucket and the average of the next
+    bucket is kept, so this needs to look one bucket ahead.
+    """
+    selected = None
+    current = []
+    for i, bucket in buckets:
+        following = list(bucket)
+        if selected is None:
+            # the first point is always kept
+            selected = following.pop(0)
+            yield selected
+            current = following
+            continue
+        if current:
+            avg_t = sum(p[0] for p in following) / float(len(following))
+            avg_v = sum(p[1] for p in following) / float(len(following))
+            selected = _largest_triangle(selected, current, (avg_t, avg_v))
+            yield selected
+        current = following
+
+    if current:
+        # the last point is always kept
+        last = current.pop()
+        if current:
+            yield _largest_triangle(selected, current, last)
+        yield last
+
+def _largest_triangle(a, points, c):
+    return max(points, key=lambda b: abs(
+        (a[0] - c[0]) * (b[1] - a[1]) - (a[0] - b[0]) * (c[1] - a[1])))
@@ -0,0 +1,112 @@
+"""
+Metadata search index. The subject fields and parameters that the archive
+can be searched on are copied into ps_metadata_search (see PSMetadataSearch)
+as (kind, field, value) rows when the metadata is created, and updated
+when a subject or parameter is saved or deleted through the ORM (see the
+signal handlers in esmond.api.models). Each subject or
+parameter filter of a search then maps to a single index lookup giving the
+ids of the matching metadata, and the filters are combined by requiring the
+metadata id to be in all of them, so no joins or DISTINCT are needed no
+matter how many filters are given.
+"""
+
+import hashlib
+import ipaddress
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Q
+
+from esmond.api.models import PSMetadataParameters, PSMetadataSearch
+from esmond.api.perfsonar.types import SUBJECT_FILTER_MAP
+
+'''
+SEARCH_KIND_SUBJECT, SEARCH_KIND_PARAMETER: The kinds of rows in the index.
+Subject rows are stored under the GET parameter name of the field (as in
+SUBJECT_FILTER_MAP) no matter the subject type and parameter rows under the
+parameter key.
+'''
+SEARCH_KIND_SUBJECT = 'subject'
+SEARCH_KIND_PARAMETER = 'parameter'
+
+def value_digest(value):
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+def search_value(value):
+    """
+    The form a value is indexed and searched for in. IP addresses are made
+    canonical so any way of writing one (ie: 2001:DB8:0:0::1) matches.
+    """
+    value = str(value)
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return value
+
+def parameter_terms(parameters):
+    return [(SEARCH_KIND_PARAMETER, p.parameter_key, search_value(p.parameter_value)) for p in parameters]
+
+def index_rows(metadata_id, terms):
+    return [PSMetadataSearch(metadata_id=metadata_id, kind=kind, field=field, value=value, digest=value_digest(value))
+        for kind, field, value in terms]
+
+def search_terms(metadata):
+    """
+    The (kind, field, value) rows of the index for a metadata object.
+    """
+    terms = []
+    for filter_name in sorted(SUBJECT_FILTER_MAP):
+        for subject_db_field in SUBJECT_FILTER_MAP[filter_name]:
+            subject_model, subject_field = subject_db_field.split('__')
+            try:
+                subject = getattr(metadata, subject_model)
+            except ObjectDoesNotExist:
+                continue
+            terms.append((SEARCH_KIND_SUBJECT, filter_name, search_value(getattr(subject, subject_field))))
+    terms.extend(parameter_terms(metadata.psmetadataparameters.all()))
+    return terms
+
+def index_metadata(metadata):
+    """
+    (Re)build the index rows of a metadata object.
+    """
+    with transaction.atomic():
+        PSMetadataSearch.objects.filter(metadata=metadata).delete()
+        PSMetadataSearch.objects.bulk_create(index_rows(metadata.id, search_terms(metadata)))
+
+def index_metadata_if_missing(metadata):
+    """
+    Build the index rows of a metadata object that has none. Every metadata
+    object has a subject, so none means it was never indexed (ie: it was 
+    stored before the index existed).
+    """
+    if not PSMetadataSearch.objects.filter(metadata=metadata).exists():
+        index_metadata(metadata)
+
+def unindex_subject(metadata_id):
+    """
+    Delete the subject rows of a metadata object whose subject was deleted.
+    """
+    PSMetadataSearch.objects.filter(metadata_id=metadata_id, kind=SEARCH_KIND_SUBJECT).delete()
+
+def unindex_parameter(metadata_id, parameter_key):
+    """
+    Rebuild the rows of parameter_key of a metadata object after one of its
+    parameters was deleted. Only those rows are touched, the metadata 
+    itself may be being deleted (ie: a cascading delete).
+    """
+    with transaction.atomic():
+        PSMetadataSearch.objects.filter(metadata_id=metadata_id, kind=SEARCH_KIND_PARAMETER, field=parameter_key).delete()
+        PSMetadataSearch.objects.bulk_create(index_rows(metadata_id, parameter_terms(
+            PSMetadataParameters.objects.filter(metadata_id=metadata_id, parameter_key=parameter_key))))
+
+def search_filter(kind, field, values):
+    """
+    Q object for PSMetadata matching the metadata with any of values for
+    field. The values are compared as well as the digests, so a digest
+    collision can't give a wrong match.
+    """
+    values = [search_value(v) for v in values]
+    matches = PSMetadataSearch.objects.filter(kind=kind, field=field,
+        digest__in=[value_digest(v) for v in values], value__in=values)
+    return Q(id__in=matches.values('metadata_id'))
@@ -247,6 +247,19 @@ ALLOWED_SUMMARIES = {
     "subinterval": [],
 }
 
+'''
+RESOLUTION_SUMMARIES: The summary that holds the same kind of value as the
+base data of each type, over a longer window. A query for the base data that
+only wants a limited number of points (see max-points) is read from the 
+coarsest window of this summary that still gives that many points. Types not
+listed are always read from the base data.
+'''
+RESOLUTION_SUMMARIES = {
+    "float": 'average',
+    "integer": 'average',
+    "percentage": 'aggregation',
+}
+
 '''
 DEFAULT_FLOAT_PRECISION: Indicates the number of decimal places to store
 for float type as 10 ^ <numeber-of-digits>.
@@ -276,6 +289,11 @@ DATA_KEY_TIME = "ts"
 DATA_KEY_VALUE = "val"
 LIMIT_FILTER = "limit"
 OFFSET_FILTER = "offset"
-RESERVED_GET_PARAMS = ["format", LIMIT_FILTER, OFFSET_FILTER, DNS_MATCH_RULE_FILTER, TIME_FILTER,
-                       TIME_START_FILTER, TIME_END_FILTER, TIME_RANGE_FILTER]
+CURSOR_FILTER = "cursor"
+PERCENTILES_FILTER = "percentiles"
+MAX_POINTS_FILTER = "max-points"
+REDUCE_FILTER = "reduce"
+RESERVED_GET_PARAMS = ["format", LIMIT_FILTER, OFFSET_FILTER, CURSOR_FILTER, DNS_MATCH_RULE_FILTER, TIME_FILTER,
+                       TIME_START_FILTER, TIME_END_FILTER, TIME_RANGE_FILTER, PERCENTILES_FILTER,
+                       MAX_POINTS_FILTER, REDUCE_FILTER]
 
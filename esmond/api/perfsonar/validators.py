@@ -1,5 +1,7 @@
 import json
 import math
+
+import numpy
 from rest_framework.exceptions import ParseError
 
 '''
@@ -66,8 +68,12 @@ class Percentile(object):
         
         if percentile == 50:
             self.key = "median"
-        else:
+        elif percentile == int(percentile):
             self.key = "percentile-%d" % percentile
+        else:
+            #repr gives the shortest string that reads back as the same float,
+            #so two different percentiles can never end up with the same key
+            self.key = "percentile-%s" % repr(float(percentile))
     
     def findvalue(self, count, hist_value):
         if self.value is not None:
@@ -85,6 +91,65 @@ class Percentile(object):
         else:
             self.value = hist_value
             
+'''
+histogram_statistics: Calculates the mode, mean, minimum, maximum, variance, 
+standard deviation and the given percentiles of a histogram. The buckets are
+converted to arrays once and everything is calculated on those, giving the 
+same results as adding up the buckets one at a time. Returns an empty dict 
+if the bucket labels are not numbers.
+'''
+DEFAULT_QUANTILES = [25, 50, 75, 95]
+
+def histogram_statistics(hist, quantiles=DEFAULT_QUANTILES):
+    #only can do statistics for histograms with numeric buckets
+    try:
+        buckets = numpy.array([float(k) for k in hist], dtype=numpy.float64)
+    except ValueError:
+        return {}
+    counts = numpy.array(list(hist.values()), dtype=numpy.int64)
+    
+    #mode, mean and sample size. cumsum adds in order, same as a loop would
+    stats = {}
+    if len(counts) > 0:
+        stats['mode'] = buckets[counts == counts.max()].tolist()
+        mean_num = float(numpy.cumsum(buckets * counts)[-1])
+    else:
+        mean_num = 0.0
+    sample_size = int(counts.sum())
+    stats['mean'] = (mean_num/(1.0*sample_size))
+    
+    #sort as numbers not strings. stable like sorted() 
+    order = numpy.argsort(buckets, kind='stable')
+    buckets = buckets[order]
+    counts = counts[order]
+    stats['minimum'] = float(buckets[0])
+    stats['maximum'] = float(buckets[-1])
+    
+    #quantiles. each percentile is found at or after the bucket of the previous one
+    cumulative = numpy.cumsum(counts)
+    start = 0
+    for q in sorted(set(quantiles)):
+        percentile = Percentile(q, sample_size)
+        i = max(start, int(numpy.searchsorted(cumulative, percentile.k, side='left')))
+        if i >= len(buckets):
+            break
+        percentile.findvalue(int(cumulative[i]), float(buckets[i]))
+        #some percentiles require next item in list
+        if not percentile.is_calculated:
+            i += 1
+            if i >= len(buckets):
+                break
+            percentile.findvalue(int(cumulative[i]), float(buckets[i]))
+        stats[percentile.key] = percentile.value
+        start = i
+    
+    #variance and std deviation
+    stddev = numpy.cumsum((buckets - stats['mean']) ** 2 * counts)[-1]
+    stats['variance'] = float(stddev)/sample_size
+    stats['standard-deviation'] = math.sqrt(stats['variance'])
+    
+    return stats
+
 '''
 HistogramValidator: Validator for histogram type
 '''
@@ -138,70 +203,8 @@ class HistogramValidator(DataValidator):
             if obj.freq in cache:
                 agg_hist = cache[obj.freq]
         
-        #pass one: mode, mean and sample size
-        stats = {}
-        mean_num = 0
-        sample_size = 0
-        for k in agg_hist:
-            #only can do statistics for histograms with numeric buckets
-            try:
-                float(k)
-            except ValueError:
-                #store empty object and return but don't fail whole operation
-                obj.value = {}
-                return
-            
-            # update calculation values
-            if 'mode' not in stats or agg_hist[k] > agg_hist[stats['mode'][0]]:
-               stats['mode'] = [ k ]
-            elif agg_hist[k] == agg_hist[stats['mode'][0]]:
-                stats['mode'].append(k)
-            mean_num += (float(k) * agg_hist[k])
-            sample_size += agg_hist[k]
-        stats['mean'] = (mean_num/(1.0*sample_size))
-        
-        #sort items. make sure sort as numbers not strings
-        sorted_hist = sorted(iter(agg_hist.items()), key=lambda k: float(k[0]))
-        
-        #make mode floats.
-        stats['mode'] = [float(x) for x in stats['mode']]
-        #get min and max
-        stats['minimum'] = float(sorted_hist[0][0])
-        stats['maximum'] = float(sorted_hist[len(sorted_hist)-1][0])
-        
-        #pass two: get quantiles, variance, and std deviation
-        stddev = 0
-        quantiles = [25, 50, 75, 95]
-        percentiles = [Percentile(q, sample_size) for q in quantiles]
-        percentile = percentiles.pop(0)
-        curr_count = 0
-        for hist_item in sorted_hist:
-            #stddev/variance
-            stddev += (math.pow(float(hist_item[0]) - stats['mean'], 2)*hist_item[1])
-            #quantiles
-            curr_count += hist_item[1]
-            while percentile is not None and curr_count >= percentile.k:
-                percentile.findvalue(curr_count, float(hist_item[0]))
-                #some percentiles require next item in list, so may have to wait until next iteration
-                if percentile.is_calculated:
-                    #calculated so add to dict
-                    stats[percentile.key] = percentile.value
-                else:
-                    #unable to calculate this pass, so break loop
-                    break
-                
-                #get next percentile
-                if len(percentiles) > 0:
-                    percentile = percentiles.pop(0)
-                else:
-                    percentile = None
-                    
-        #set standard deviation
-        stats['variance'] = stddev/sample_size
-        stats['standard-deviation'] = math.sqrt(stats['variance'])
-        
-        #set value
-        obj.value = stats
+        #set value. store empty object if buckets are not numeric but don't fail whole operation
+        obj.value = histogram_statistics(agg_hist)
   
 
 '''
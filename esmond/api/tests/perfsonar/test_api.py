@@ -1,16 +1,27 @@
+import calendar
+import datetime
 import json
 import os
+import threading
 import time
+from socket import AF_INET, AF_INET6
+from unittest import SkipTest
 
 # This MUST be here in any testing modules that use cassandra!
 os.environ['ESMOND_UNIT_TESTS'] = 'True'
 
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache.backends.locmem import LocMemCache
 from django.utils.timezone import now
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from esmond.api.models import PSEventTypes, UserIpAddress
+from esmond.api.models import PSEventTypes, PSMetadata, PSMetadataDocument, PSMetadataParameters, PSMetadataSearch, PSPointToPointSubject, UserIpAddress
+from esmond.api.perfsonar import api_v2
+from esmond.api.perfsonar.api_v2 import get_summaries, invalidate_summaries, FilterUtilMixin, HostnameLookupTimeout, HostnameResolver, TimeUpdatedRecorder, TimeSeriesViewset
+from esmond.api.perfsonar.search import SEARCH_KIND_PARAMETER, index_metadata, value_digest
 from esmond.api.perfsonar.types import *
 from esmond.cassandra import CASSANDRA_DB
 from esmond.config import get_config, get_config_path
@@ -53,10 +64,33 @@ class PSAPIBaseTest(TestCase):
 
         self.client = APIClient()
 
+        #fixtures don't go through the serializer so index them here
+        for metadata in PSMetadata.objects.all():
+            index_metadata(metadata)
+
+    def advance_clock(self, seconds=1):
+        """
+        Moves time.time() on for the rest of the test, ie: past the second 
+        of the last write (time_updated is kept in seconds), without 
+        sleeping.
+        """
+        if not hasattr(self, 'clock_offset'):
+            real_time = time.time
+            self.clock_offset = 0
+            self.addCleanup(setattr, time, 'time', real_time)
+            time.time = lambda: real_time() + self.clock_offset
+        self.clock_offset += seconds
+
+    def get_json(self, response):
+        # Time series responses are streamed so have no .content
+        if response.streaming:
+            return json.loads(b''.join(response.streaming_content))
+        return json.loads(response.content)
+
     def assertExpectedResponse(self, expected, url, get_params={}):
         response = self.client.get(url, get_params)
         self.assertHttpOK(response)
-        data = json.loads(response.content)
+        data = self.get_json(response)
 
         # Trigger object inspection if we have a mismatch. This is to 
         # assist in debugging
@@ -409,6 +443,103 @@ class PSArchiveResourceTest(PSAPIBaseTest):
         self.assertMetadataCount(5, url, {OFFSET_FILTER: 5, LIMIT_FILTER: 5})
         self.assertMetadataCount(6, url, {OFFSET_FILTER: 10, LIMIT_FILTER: 10})
         
+    def test_get_metadata_list_queries(self):
+        url = '/{0}/archive/'.format(PS_ROOT)
+        num_queries = []
+        for limit in [1, 1000]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'limit': limit})
+            self.assertHttpOK(response)
+            self.assertEquals(min(limit, PSMetadata.objects.count()), len(self.get_json(response)))
+            num_queries.append(len(queries))
+        #the number of queries doesn't grow with the number of metadata objects
+        self.assertTrue(PSMetadata.objects.count() > 1)
+        self.assertEquals(num_queries[0], num_queries[1])
+        self.assertTrue(num_queries[1] <= 10)
+        #now that all documents are stored listing doesn't need to build any
+        with CaptureQueriesContext(connection) as queries:
+            self.assertHttpOK(self.client.get(url, {'limit': 1000}))
+        self.assertTrue(len(queries) <= 4)
+    
+    def test_metadata_documents(self):
+        url = '/{0}/archive/'.format(PS_ROOT)
+        md_key = 'e99bbc44b7b041c7ad9e51dc6a053b8c'
+        PSMetadataDocument.objects.all().delete()
+        built = self.get_json(self.client.get(url))
+        self.assertEquals(PSMetadata.objects.count(), PSMetadataDocument.objects.count())
+        #stored documents give the same response and URLs follow the host
+        self.assertEquals(built, self.get_json(self.client.get(url)))
+        detail = [md for md in built if md['metadata-key'] == md_key][0]
+        self.assertEquals('http://testserver/{0}/archive/{1}/'.format(PS_ROOT, md_key), detail['url'])
+        self.assertEquals('/{0}/archive/{1}/'.format(PS_ROOT, md_key), detail['uri'])
+        self.assertEquals(detail['url'].replace('testserver', 'example.net'), 
+            [md for md in self.get_json(self.client.get(url, HTTP_HOST='example.net')) if md['metadata-key'] == md_key][0]['url'])
+        #and match the detail view, apart from the pagination details
+        for k in ['metadata-count-total', 'metadata-previous-page', 'metadata-next-page']:
+            detail.pop(k, None)
+        self.assertEquals(self.get_json(self.client.get(detail['uri'])), detail)
+        #updating time_updated leaves the document out of date, listing 
+        #builds it again
+        TimeUpdatedRecorder(0).record(md_key, ['throughput'])
+        self.assertTrue(PSMetadataDocument.objects.filter(metadata__metadata_key=md_key).exists())
+        updated = [md for md in self.get_json(self.client.get(url)) if md['metadata-key'] == md_key][0]
+        time_updated = PSEventTypes.objects.get(metadata__metadata_key=md_key, event_type='throughput', summary_type='base').time_updated
+        self.assertEquals(calendar.timegm(time_updated.utctimetuple()), 
+            [et for et in updated['event-types'] if et['event-type'] == 'throughput'][0]['time-updated'])
+        self.assertEquals(time_updated, PSMetadataDocument.objects.get(metadata__metadata_key=md_key).time_updated)
+        #a document stored before its event types changed is built again
+        time_updated += datetime.timedelta(seconds=60)
+        PSEventTypes.objects.filter(metadata__metadata_key=md_key, event_type='throughput', summary_type='base').update(time_updated=time_updated)
+        self.assertTrue(PSMetadataDocument.objects.filter(metadata__metadata_key=md_key).exists())
+        updated = [md for md in self.get_json(self.client.get(url)) if md['metadata-key'] == md_key][0]
+        self.assertEquals(calendar.timegm(time_updated.utctimetuple()), 
+            [et for et in updated['event-types'] if et['event-type'] == 'throughput'][0]['time-updated'])
+        self.assertEquals(time_updated, PSMetadataDocument.objects.get(metadata__metadata_key=md_key).time_updated)
+        #changes made through the ORM (ie: the admin) drop the document
+        list_etag = self.client.get(url)['ETag']
+        detail_etag = self.client.get(detail['uri'])['ETag']
+        self.assertEquals(304, self.client.get(url, HTTP_IF_NONE_MATCH=list_etag).status_code)
+        self.assertEquals(304, self.client.get(detail['uri'], HTTP_IF_NONE_MATCH=detail_etag).status_code)
+        param = PSMetadataParameters.objects.filter(metadata__metadata_key=md_key)[0]
+        param.parameter_value = 'changed'
+        param.save()
+        self.assertFalse(PSMetadataDocument.objects.filter(metadata__metadata_key=md_key).exists())
+        #and the ETags change with the documents
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=list_etag)
+        self.assertHttpOK(response)
+        updated = [md for md in self.get_json(response) if md['metadata-key'] == md_key][0]
+        self.assertEquals('changed', updated[param.parameter_key])
+        response = self.client.get(detail['uri'], HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertHttpOK(response)
+        self.assertEquals('changed', self.get_json(response)[param.parameter_key])
+    
+    def test_search_index_updates(self):
+        url = '/{0}/archive/'.format(PS_ROOT)
+        md_key = 'e99bbc44b7b041c7ad9e51dc6a053b8c'
+        search = lambda params: dict(params, **{METADATA_KEY_FILTER: md_key})
+        self.assertMetadataCount(1, url, search({'ip-tos': '32', 'source': '198.124.238.66'}))
+        #changes made through the ORM (ie: the admin) are searched on right away
+        param = PSMetadataParameters.objects.get(metadata__metadata_key=md_key, parameter_key='ip-tos')
+        param.parameter_value = '64'
+        param.save()
+        self.assertMetadataCount(0, url, search({'ip-tos': '32'}))
+        self.assertMetadataCount(1, url, search({'ip-tos': '64'}))
+        param.delete()
+        self.assertMetadataCount(0, url, search({'ip-tos': '64'}))
+        self.assertMetadataCount(1, url, search({'time-duration': '20'}))
+        subject = PSPointToPointSubject.objects.get(metadata__metadata_key=md_key)
+        subject.source = '2001:db8::1'
+        subject.save()
+        self.assertMetadataCount(0, url, search({'source': '198.124.238.66'}))
+        self.assertMetadataCount(1, url, search({'source': '2001:db8::1'}))
+        #IP addresses match however they are written
+        PSMetadataParameters.objects.create(metadata=subject.metadata, parameter_key='ip-remote-address', parameter_value='2001:DB8:0:0::1')
+        self.assertMetadataCount(1, url, search({'ip-remote-address': '2001:db8::1'}))
+        self.assertMetadataCount(1, url, search({'ip-remote-address': '2001:db8:0::0:1'}))
+        self.assertMetadataCount(1, url, search({'source': '2001:DB8:0:0::1'}))
+        subject.delete()
+        self.assertMetadataCount(0, url, search({'source': '2001:db8::1'}))
+    
     def test_get_metadata_detail(self):
         url = '/{0}/archive/e99bbc44b7b041c7ad9e51dc6a053b8c/'.format(PS_ROOT)
         response = self.client.get(url)
@@ -463,6 +594,107 @@ class PSArchiveResourceTest(PSAPIBaseTest):
         self.assertEquals(new_data['uri'], existing_uri )
         self.assertEquals(new_data['metadata-key'], existing_mdkey )
         
+        #test the new object can be searched on its subject and parameters
+        self.assertMetadataCount(1, url, {'source': '10.1.1.1', 'tool-name': 'bwctl/iperf3', 'time-interval': 7200})
+        self.assertMetadataCount(0, url, {'source': '10.1.1.1', 'time-interval': 3600})
+        
+        #posting it again indexes it if it never was
+        PSMetadataSearch.objects.filter(metadata__metadata_key=existing_mdkey).delete()
+        self.assertMetadataCount(0, url, {'source': '10.1.1.1', 'tool-name': 'bwctl/iperf3'})
+        response = self.get_api_client(admin_auth=True).post(url, format='json', data=self.post_data)
+        self.assertHttpCreated(response)
+        self.assertMetadataCount(1, url, {'source': '10.1.1.1', 'tool-name': 'bwctl/iperf3', 'time-interval': 7200})
+        
+    def test_summary_cache(self):
+        md_key = 'e99bbc44b7b041c7ad9e51dc6a053b8c'
+        invalidate_summaries(md_key, ['throughput', 'histogram-rtt'])
+        #first lookup goes to the database, second comes from the cache
+        with self.assertNumQueries(1):
+            summaries = get_summaries(md_key, ['throughput', 'histogram-rtt'])
+        with self.assertNumQueries(0):
+            self.assertEquals(summaries, get_summaries(md_key, ['throughput', 'histogram-rtt']))
+        self.assertIn('base', [s[0] for s in summaries['throughput']])
+        self.assertIn('average', [s[0] for s in summaries['throughput']])
+        #event types not defined for the metadata have no summaries
+        self.assertEquals([], summaries['histogram-rtt'])
+        
+    def test_hostname_resolver(self):
+        class FakeResolver(HostnameResolver):
+            lookups = 0
+            now = 0
+            #both lookups of a host have to be running at the same time to 
+            #get past the barrier
+            both_families = threading.Barrier(2, timeout=10)
+            release = threading.Event()
+            def clock(self):
+                return self.now
+            def resolve(self, host, family):
+                self.lookups += 1
+                if host == 'v4.example.net':
+                    self.both_families.wait()
+                    return '10.0.0.1' if family == AF_INET else None
+                if host == 'slow.example.net':
+                    self.release.wait(10)
+                    return '10.0.0.2'
+                if host == 'busy.example.net':
+                    #the lookup takes up most of the time of the request
+                    self.now += 4
+                return '10.0.0.3'
+        
+        resolver = FakeResolver(300, 60, 100, 2)
+        #A and AAAA lookups are done at the same time
+        self.assertEquals({AF_INET: '10.0.0.1', AF_INET6: None}, resolver.lookup('v4.example.net', [AF_INET, AF_INET6], 5))
+        #addresses and missing addresses both come from the cache after that
+        self.assertEquals({AF_INET: '10.0.0.1', AF_INET6: None}, resolver.lookup('v4.example.net', [AF_INET, AF_INET6], 5))
+        self.assertEquals(2, resolver.lookups)
+        #a lookup that takes too long is an error, not a missing address, 
+        #and isn't repeated
+        self.assertRaises(HostnameLookupTimeout, resolver.lookup, 'slow.example.net', [AF_INET], 0)
+        self.assertRaises(HostnameLookupTimeout, resolver.lookup, 'slow.example.net', [AF_INET], 0)
+        self.assertEquals(3, resolver.lookups)
+        resolver.release.set()
+        self.assertEquals({AF_INET: '10.0.0.2'}, resolver.lookup('slow.example.net', [AF_INET], None))
+        self.assertEquals(3, resolver.lookups)
+        
+        #a lookup still waiting for a thread of a full pool times out too
+        resolver = FakeResolver(300, 60, 100, 1)
+        resolver.release = threading.Event()
+        self.addCleanup(resolver.release.set)
+        resolver._submit(('slow.example.net', AF_INET))
+        resolver.now = 5
+        self.assertRaises(HostnameLookupTimeout, resolver.lookup, 'queued.example.net', [AF_INET], 5)
+        
+        #all the lookups of a request share one deadline
+        resolver = FakeResolver(300, 60, 100, 2)
+        resolver.release = threading.Event()
+        self.addCleanup(resolver.release.set)
+        self.addCleanup(setattr, api_v2, 'hostname_resolver', api_v2.hostname_resolver)
+        self.addCleanup(setattr, api_v2.esmond_conf, 'dns_lookup_timeout', api_v2.esmond_conf.dns_lookup_timeout)
+        api_v2.hostname_resolver = resolver
+        api_v2.esmond_conf.dns_lookup_timeout = 5
+        view = FilterUtilMixin()
+        self.assertEquals('10.0.0.3', view.lookup_hostname('busy.example.net', AF_INET))
+        resolver.now += 1
+        self.assertRaises(HostnameLookupTimeout, view.lookup_hostname, 'slow.example.net', AF_INET)
+        #the next request gets a deadline of its own
+        resolver.release.set()
+        self.assertEquals('10.0.0.2', FilterUtilMixin().lookup_hostname('slow.example.net', AF_INET))
+        
+    def test_time_updated_recorder(self):
+        md_key = 'e99bbc44b7b041c7ad9e51dc6a053b8c'
+        get_time_updated = lambda: PSEventTypes.objects.get(metadata__metadata_key=md_key, 
+            event_type='throughput', summary_type='base').time_updated
+        before = get_time_updated()
+        recorder = TimeUpdatedRecorder(3600)
+        recorder.record(md_key, ['throughput'])
+        recorder.record(md_key, ['throughput'])
+        #nothing is written until the recorder is flushed
+        self.assertEquals(before, get_time_updated())
+        recorder.flush()
+        after = get_time_updated()
+        self.assertGreater(after, before)
+        self.assertEquals(0, after.microsecond)
+        
 class PSArchiveResourceDataTest(PSAPIBaseTest):
     '''
     Test querying data from API. Since we want to test that the server calculates
@@ -598,7 +830,7 @@ class PSArchiveResourceDataTest(PSAPIBaseTest):
         self.assertHttpCreated(response)
         response = self.client.get(url, {'time': ts})
         self.assertHttpOK(response)
-        response_data = json.loads(response.content)
+        response_data = self.get_json(response)
         self.assertEquals(len(response_data), 1)
         if(test_equals):
             self.assertEquals(post_data, response_data[0])
@@ -623,7 +855,7 @@ class PSArchiveResourceDataTest(PSAPIBaseTest):
         self.assertHttpCreated(response)
         response = self.client.get(base_url, {'time-start': start, 'time-end': end})
         self.assertHttpOK(response)
-        response_data = json.loads(response.content)
+        response_data = self.get_json(response)
         self.assertEquals(len(response_data), len(data))
     
     def assertAuthFailure(self, url, ts, val, cred):
@@ -660,6 +892,57 @@ class PSArchiveResourceDataTest(PSAPIBaseTest):
         bulk_url = '/{0}/archive/f6b732e9f351487a96126f0c25e5e546/'.format(PS_ROOT)
         self.assertBulkTSPutSuccess(bulk_url, base_url, start, interval, self.int_data, 'throughput')
         
+        #page through the base data
+        response = self.client.get(base_url, {'limit': 2, 'offset': 1})
+        self.assertHttpOK(response)
+        self.assertEquals([start + interval, start + 2*interval], [d['ts'] for d in self.get_json(response)])
+        self.assertIn('rel="next"', response['Link'])
+        self.assertIn('rel="prev"', response['Link'])
+        response = self.client.get(base_url, {'limit': 2, 'offset': 2})
+        self.assertHttpOK(response)
+        self.assertEquals(2, len(self.get_json(response)))
+        self.assertNotIn('rel="next"', response['Link'])
+        #pages are no bigger than max_limit whatever the limit
+        self.addCleanup(setattr, api_v2.PSPaginator, 'max_limit', api_v2.PSPaginator.max_limit)
+        api_v2.PSPaginator.max_limit = 3
+        response = self.client.get(base_url, {'limit': 10})
+        self.assertHttpOK(response)
+        self.assertEquals([start, start + interval, start + 2*interval], [d['ts'] for d in self.get_json(response)])
+        self.assertIn('rel="next"', response['Link'])
+        
+        #page through the base data with a cursor
+        response = self.client.get(base_url, {'limit': 3, 'cursor': ''})
+        self.assertHttpOK(response)
+        self.assertEquals(3, len(self.get_json(response)))
+        next_url = response['Link'].split(';')[0].strip('<>')
+        response = self.client.get(next_url)
+        self.assertHttpOK(response)
+        self.assertEquals([start + 3*interval], [d['ts'] for d in self.get_json(response)])
+        self.assertFalse(response.has_header('Link'))
+        
+        #downsample the base data to two points
+        params = {'time-start': start, 'time-end': start + 3*interval, 'max-points': 2}
+        expected = [
+            {"ts": start, "val": (self.int_data[0] + self.int_data[1])/2.0},
+            {"ts": start + 10801, "val": (self.int_data[2] + self.int_data[3])/2.0}
+        ]
+        self.assertExpectedResponse(expected, base_url, params)
+        params['reduce'] = 'max'
+        expected = [
+            {"ts": start, "val": max(self.int_data[:2])},
+            {"ts": start + 10801, "val": max(self.int_data[2:])}
+        ]
+        self.assertExpectedResponse(expected, base_url, params)
+        params.update({'reduce': 'lttb', 'max-points': 3})
+        response = self.client.get(base_url, params)
+        self.assertHttpOK(response)
+        response_data = self.get_json(response)
+        self.assertEquals(3, len(response_data))
+        self.assertEquals(start, response_data[0]['ts'])
+        self.assertEquals(start + 3*interval, response_data[-1]['ts'])
+        params['reduce'] = 'median'
+        self.assertHttpBadRequest(self.client.get(base_url, params))
+        
         #query average summary
         expected = [{"ts": 1398902400, "val": 6575755000.0}]
         avg_url = '/{0}/archive/f6b732e9f351487a96126f0c25e5e546/throughput/averages/86400/'.format(PS_ROOT)
@@ -669,6 +952,15 @@ class PSArchiveResourceDataTest(PSAPIBaseTest):
         expected = [{"ts": 1398902400, "val": 26303020000}]
         agg_url = '/{0}/archive/f6b732e9f351487a96126f0c25e5e546/throughput/aggregations/86400/'.format(PS_ROOT)
         self.assertExpectedResponse(expected, agg_url)
+        
+        #downsampled averages of long ranges are read from the daily averages
+        day = 1398902400
+        view = TimeSeriesViewset()
+        self.assertEquals(('averages', '86400'), view.resolution_summary('f6b732e9f351487a96126f0c25e5e546', 'throughput', day, day + 10*86400, 5))
+        self.assertEquals(('base', None), view.resolution_summary('f6b732e9f351487a96126f0c25e5e546', 'throughput', day, day + 86400, 5))
+        self.assertEquals(('base', None), view.resolution_summary('f6b732e9f351487a96126f0c25e5e546', 'failures', day, day + 10*86400, 5))
+        expected = [{"ts": day, "val": 6575755000.0}]
+        self.assertExpectedResponse(expected, base_url, {'time-start': start, 'time-end': day + 10*86400, 'max-points': 5})
     
     def test_float_data(self):
         base_url = '/{0}/archive/67a3c298de0b4237abee56b879e03587/time-error-estimates/base/'.format(PS_ROOT)
@@ -698,6 +990,140 @@ class PSArchiveResourceDataTest(PSAPIBaseTest):
         agg_url = '/{0}/archive/67a3c298de0b4237abee56b879e03587/time-error-estimates/aggregations/86400/'.format(PS_ROOT)
         self.assertExpectedResponse(expected, agg_url)
     
+    def test_bulk_timeseries_query(self):
+        start = 1401965989
+        series = [
+            ('67a3c298de0b4237abee56b879e03587', 'time-error-estimates', self.float_data[:2]),
+            ('f6b732e9f351487a96126f0c25e5e546', 'throughput', self.int_data[:2]),
+        ]
+        for metadata_key, event_type, data in series:
+            base_url = '/{0}/archive/{1}/{2}/base/'.format(PS_ROOT, metadata_key, event_type)
+            for i, val in enumerate(data):
+                self.assertSinglePostSuccess(base_url, start + i*60, val)
+        
+        #every combination of metadata key and event type is returned
+        url = '/{0}/timeseries/'.format(PS_ROOT)
+        params = {
+            'metadata-key': ','.join([s[0] for s in series]),
+            'event-type': [s[1] for s in series],
+            'time-start': start,
+            'time-end': start + 60,
+        }
+        response = self.client.get(url, params)
+        self.assertHttpOK(response)
+        response_data = self.get_json(response)
+        self.assertEquals(4, len(response_data))
+        for d in response_data:
+            self.assertEquals('base', d['summary-type'])
+            expected = [s[2] for s in series if (s[0], s[1]) == (d['metadata-key'], d['event-type'])]
+            if expected:
+                self.assertEquals(expected[0], [v['val'] for v in d['data']])
+                self.assertEquals([start, start + 60], [v['ts'] for v in d['data']])
+            else:
+                self.assertEquals([], d['data'])
+        
+        #the limit applies to each time series
+        params['limit'] = 1
+        response = self.client.get(url, params)
+        self.assertHttpOK(response)
+        for d in self.get_json(response):
+            self.assertTrue(len(d['data']) <= 1)
+        
+        #conditional GET until one of the time series is written to, once
+        #the second of the last write is over
+        self.advance_clock()
+        response = self.client.get(url, params)
+        etag = response['ETag']
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(304, response.status_code)
+        base_url = '/{0}/archive/{1}/{2}/base/'.format(PS_ROOT, series[1][0], series[1][1])
+        #time_updated is in seconds
+        self.advance_clock()
+        self.assertSinglePostSuccess(base_url, start + 120, self.int_data[2])
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertHttpOK(response)
+        
+        #bad requests
+        self.assertHttpBadRequest(self.client.get(url, {'event-type': 'throughput'}))
+        self.assertHttpBadRequest(self.client.get(url, {'metadata-key': series[0][0], 'event-type': 'bad-type'}))
+        self.assertHttpBadRequest(self.client.get(url, {'metadata-key': series[0][0], 'event-type': 'throughput', 'summary-type': 'aggregations'}))
+    
+    def test_timeseries_response_cache(self):
+        base_url = '/{0}/archive/67a3c298de0b4237abee56b879e03587/time-error-estimates/base/'.format(PS_ROOT)
+        start = 1402965989
+        params = {'time-start': start, 'time-end': start + 3600}
+        self.assertSinglePostSuccess(base_url, start, self.float_data[0])
+        
+        #the cache is off unless a backend is configured
+        response = self.client.get(base_url, params)
+        self.assertHttpOK(response)
+        self.assertTrue(response.streaming)
+        self.addCleanup(setattr, api_v2, 'timeseries_cache', api_v2.timeseries_cache)
+        self.addCleanup(setattr, api_v2.esmond_conf, 'timeseries_cache_backend', api_v2.esmond_conf.timeseries_cache_backend)
+        api_v2.esmond_conf.timeseries_cache_backend = 'django.core.cache.backends.locmem.LocMemCache'
+        api_v2.timeseries_cache = LocMemCache('test_timeseries', {})
+        
+        #nothing is cached and there are no validators until the second of
+        #the last write is over
+        self.advance_clock()
+        
+        #the time range is over so the response is cached with an ETag
+        response = self.client.get(base_url, params)
+        self.assertHttpOK(response)
+        self.assertFalse(response.streaming)
+        self.assertEquals(1, len(self.get_json(response)))
+        etag = response['ETag']
+        response = self.client.get(base_url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(304, response.status_code)
+        self.assertEquals(etag, response['ETag'])
+        
+        #writing to the event type makes the cached responses stale
+        self.assertSinglePostSuccess(base_url, start + 60, self.float_data[1])
+        self.advance_clock()
+        response = self.client.get(base_url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertHttpOK(response)
+        self.assertFalse(response.streaming)
+        self.assertEquals(2, len(self.get_json(response)))
+        self.assertNotEquals(etag, response['ETag'])
+        
+        #other parameters get their own response
+        response = self.client.get(base_url, dict(params, limit=1))
+        self.assertHttpOK(response)
+        self.assertEquals(1, len(self.get_json(response)))
+        self.assertIn('<http://testserver/', response['Link'])
+        #and so do other hosts, the links point at the host asked
+        response = self.client.get(base_url, dict(params, limit=1), HTTP_HOST='example.net')
+        self.assertHttpOK(response)
+        self.assertFalse(response.streaming)
+        self.assertIn('<http://example.net/', response['Link'])
+        
+        #open ended ranges are not cached
+        response = self.client.get(base_url, {'time-start': start})
+        self.assertHttpOK(response)
+        self.assertTrue(response.streaming)
+        
+        #nothing has changed since the last response, no need to query cassandra
+        last_modified = response['Last-Modified']
+        response = self.client.get(base_url, {'time-start': start}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(304, response.status_code)
+        response = self.client.get(base_url, {'time-start': start}, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEquals(304, response.status_code)
+        
+        #time ranges relative to the current time move on
+        response = self.client.get(base_url, {'time-range': 3600})
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.advance_clock()
+        response = self.client.get(base_url, {'time-range': 3600}, HTTP_IF_NONE_MATCH=etag)
+        self.assertHttpOK(response)
+        
+        #the metadata too
+        md_url = '/{0}/archive/67a3c298de0b4237abee56b879e03587/'.format(PS_ROOT)
+        response = self.client.get(md_url)
+        self.assertHttpOK(response)
+        response = self.client.get(md_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(304, response.status_code)
+    
     def test_json_data(self):
         base_url = '/{0}/archive/f6b732e9f351487a96126f0c25e5e546/failures/base/'.format(PS_ROOT)
         start = 1398965989
@@ -788,6 +1214,12 @@ class PSArchiveResourceDataTest(PSAPIBaseTest):
         stat_url = '/{0}/archive/67a3c298de0b4237abee56b879e03587/histogram-rtt/statistics/86400/'.format(PS_ROOT)
         self.assertExpectedResponse(expected, stat_url)
         
+        #query percentiles merged over the time range
+        expected =[{u'ts': 1398902400, u'val': {u'standard-deviation': 0.6333174559413313, u'median': 41.1, u'maximum': 50.0, u'minimum': 41.0, u'mode': [41.1, 41.0], u'percentile-99.9': 50.0, u'variance': 0.40109100000000003, u'mean': 41.097}}]
+        self.assertExpectedResponse(expected, agg_url, {'percentiles': '50,99.9'})
+        self.assertHttpBadRequest(self.client.get(agg_url, {'percentiles': '100'}))
+        self.assertHttpBadRequest(self.client.get(stat_url, {'percentiles': '99'}))
+        
         #test non-numeric key(should work) and re-check stats
         self.assertSinglePostSuccess(base_url, start+1000, {'test': 100})
         self.assertExpectedResponse([{u'ts': 1398902400, u'val': {}}], stat_url)
@@ -835,3 +1267,89 @@ class PSArchiveResourceDataTest(PSAPIBaseTest):
         p.findvalue(4, 100)
         p.findvalue(6, 101)
         self.assertEquals(p.value, 100.45)
+        
+        #test statistics with requested percentiles and non-numeric buckets
+        stats = histogram_statistics({'1': 3, '2': 5}, [99.9, 1, 50])
+        self.assertEquals(stats['percentile-1'], 1.0)
+        self.assertEquals(stats['median'], 2.0)
+        self.assertEquals(stats['percentile-99.9'], 2.0)
+        self.assertEquals(stats['mode'], [2.0])
+        self.assertEquals(stats['mean'], 1.625)
+        self.assertEquals(stats['variance'], 0.234375)
+        self.assertEquals(histogram_statistics({'a': 1}), {})
+        
+        #test close percentiles get their own keys
+        self.assertEquals(Percentile(99.9999999, 10).key, 'percentile-99.9999999')
+        self.assertEquals(Percentile(99.99999991, 10).key, 'percentile-99.99999991')
+        self.assertEquals(Percentile(99.0, 10).key, 'percentile-99')
+
+class PSQueryPlanTest(TestCase):
+    '''
+    Checks the database uses the indexes for the queries the API does most
+    on a dataset large enough that scanning the tables costs more.
+    '''
+    num_metadata = 4000
+    
+    @classmethod
+    def setUpTestData(cls):
+        #the dataset is big, so it is built once for all the tests
+        if connection.vendor not in ['postgresql', 'sqlite']:
+            raise SkipTest("No query plans for %s" % connection.vendor)
+        event_types = sorted(EVENT_TYPE_CONFIG)[:10]
+        latest = now().replace(microsecond=0)
+        metadata = [PSMetadata(id=i, metadata_key='plan%028d' % i, subject_type='point-to-point', checksum='plan%d' % i)
+            for i in range(1, cls.num_metadata + 1)]
+        PSMetadata.objects.bulk_create(metadata)
+        rows = []
+        for md in metadata:
+            for j, et in enumerate(event_types):
+                #spread the updates over a year and leave some never updated
+                updated = None if j == 0 else latest - datetime.timedelta(seconds=(md.id * 7919 + j) % 31536000)
+                rows.append(PSEventTypes(metadata=md, event_type=et, summary_type='base', summary_window=0, time_updated=updated))
+                rows.append(PSEventTypes(metadata=md, event_type=et, summary_type='aggregation', summary_window=3600, time_updated=updated))
+        PSEventTypes.objects.bulk_create(rows)
+        for md in metadata[:200]:
+            #indexed when saved
+            PSMetadataParameters.objects.create(metadata=md, parameter_key='time-interval', parameter_value=str(md.id % 4))
+        connection.cursor().execute('ANALYZE')
+        cls.event_type = event_types[1]
+        cls.latest = latest
+    
+    def explain(self, queryset):
+        #without the default ordering, like the subqueries the API uses
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor = connection.cursor()
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+        cursor.execute('EXPLAIN ' + sql, params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+    
+    def assertUsesIndex(self, index, queryset):
+        plan = self.explain(queryset)
+        self.assertIn(index, plan, "%s not used by:\n%s" % (index, plan))
+    
+    def test_event_types_of_metadata(self):
+        #get_summaries(), get_last_updated() and the archive serializer
+        self.assertUsesIndex('ps_et_md_summary_idx', PSEventTypes.objects.filter(metadata_id=42, event_type=self.event_type))
+        self.assertUsesIndex('ps_et_md_summary_idx', PSEventTypes.objects.filter(metadata__metadata_key='plan%028d' % 42))
+    
+    def test_event_type_filters(self):
+        #event-type filter with and without time filters
+        self.assertUsesIndex('ps_et_type_updated_idx', PSEventTypes.objects.filter(
+            event_type=self.event_type, time_updated__gte=self.latest - datetime.timedelta(seconds=3600)).values('metadata_id'))
+        self.assertUsesIndex('ps_et_type_updated_idx', PSEventTypes.objects.filter(
+            event_type=self.event_type, summary_type='base').values('metadata_id'))
+    
+    def test_time_filters(self):
+        #time filters without an event type use the partial index
+        self.assertUsesIndex('ps_et_updated_idx', PSEventTypes.objects.filter(
+            time_updated__gte=self.latest - datetime.timedelta(seconds=3600)).values('metadata_id'))
+        self.assertUsesIndex('ps_et_updated_idx', PSEventTypes.objects.filter(
+            time_updated__gte=self.latest - datetime.timedelta(seconds=7200),
+            time_updated__lte=self.latest - datetime.timedelta(seconds=3600)).values('metadata_id'))
+    
+    def test_parameter_filters(self):
+        #parameter filters are looked up in the search index
+        self.assertUsesIndex('ps_metadata_search_kind', PSMetadataSearch.objects.filter(kind=SEARCH_KIND_PARAMETER,
+            field='time-interval', digest=value_digest('1'), value='1').values('metadata_id'))
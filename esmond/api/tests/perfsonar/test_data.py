@@ -14,7 +14,8 @@ from django.test import TestCase
 from django.conf import settings
 
 from esmond.config import get_config, get_config_path
-from esmond.cassandra import CASSANDRA_DB, RawRateData, BaseRateBin
+from esmond.cassandra import CASSANDRA_DB, RawRateData, BaseRateBin, get_rowkey, _split_rowkey
+from esmond.util import LRUCache
 
 from esmond.api.tests.example_data import load_test_data
 
@@ -231,4 +232,82 @@ class DataTest(TestCase):
         self.assertEqual(ret[-1]['ts'], self.tr.packet_lost_end_ts)
         self.assertEqual(ret[-1]['val'], self.tr.packet_lost_end_val)
 
-
+    def test_multi_year_values(self):
+        config = get_config(get_config_path())
+        config.cassandra_fetch_threads = 4
+        db = CASSANDRA_DB(config)
+        self.assertIsNotNone(db._fetch_pool)
+
+        # spans the 2013 and 2014 rows
+        q_start = 1382995070000
+        q_end = 1391721631000
+
+        ret = db.query_baserate_timerange(path=self.tr.throughput_path,
+            ts_min=q_start, ts_max=q_end)
+        ts = [r['ts'] for r in ret]
+        self.assertEqual(ts, sorted(ts))
+        self.assertEqual(ts[0], q_start)
+
+        # the rows read one after the other give the same result
+        pool, db._fetch_pool = db._fetch_pool, None
+        self.assertEqual(ret, db.query_baserate_timerange(path=self.tr.throughput_path,
+            ts_min=q_start, ts_max=q_end))
+        db._fetch_pool = pool
+
+        # the rows are merged in time order whatever order the keys are in
+        keys = db._get_row_keys(self.tr.throughput_path, None, q_start, q_end)
+        self.assertEqual(ts, [c[1] for c in db._iter_columns(
+            db.rates._column_family, keys[::-1], q_start, q_end)])
+
+        # column limits still apply across the rows
+        for count in [1, len(ret) - 1, len(ret) + 1]:
+            self.assertEqual(ret[:count], db.query_baserate_timerange(
+                path=self.tr.throughput_path, ts_min=q_start, ts_max=q_end,
+                column_count=count))
+
+class LRUCacheTest(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        # touch a so b is the least recently used
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache['a'], 1)
+        self.assertEqual(cache['c'], 3)
+        self.assertEqual(cache.stats(), {'size': 2, 'maxsize': 2, 'hits': 1,
+            'misses': 1, 'evictions': 1, 'expirations': 0})
+
+    def test_expiry(self):
+        cache = LRUCache(maxsize=10, ttl=-1)
+        cache['a'] = 1
+        cache.set('b', 2, ttl=3600)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+class RowKeyTest(TestCase):
+    path = ['ps', 'packet_count_sent', '0CB19291FB6D40EAA1955376772BF5D2']
+
+    def test_rowkey(self):
+        self.assertEqual(get_rowkey(self.path, freq=30000, year=2014),
+            'ps:packet_count_sent:0CB19291FB6D40EAA1955376772BF5D2:30000:2014')
+        # same key from a tuple, and the cached key isn't confused by
+        # a different freq/year
+        self.assertEqual(get_rowkey(tuple(self.path), freq=30000, year=2014),
+            get_rowkey(self.path, freq=30000, year=2014))
+        self.assertEqual(get_rowkey(self.path),
+            'ps:packet_count_sent:0CB19291FB6D40EAA1955376772BF5D2')
+        self.assertEqual(get_rowkey(['ps', 'a:b'], year=2014), 'ps:a\\:b:2014')
+
+    def test_split_rowkey(self):
+        self.assertEqual(_split_rowkey('ps:a\\:b:30000:2014'),
+            ['ps', 'a:b', '30000', '2014'])
+        self.assertEqual(_split_rowkey(':ps:a'), ['', 'ps', 'a'])
+        # escapes are only stripped up to the last delimiter
+        self.assertEqual(_split_rowkey('ps:a\\:b'), ['ps', 'a\\:b'])
+        self.assertEqual(_split_rowkey(get_rowkey(self.path, freq=30000)),
+            self.path + ['30000'])
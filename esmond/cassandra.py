@@ -47,15 +47,21 @@ esmond schema in json-like notation:
 import ast
 import calendar
 import datetime
+import functools
+import heapq
+import itertools
 import json
 import logging
+import operator
 import os
 import pprint
+import re
 import sys
 import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from esmond.util import get_logger
+from esmond.util import get_logger, LRUCache
 
 # Third party
 from pycassa import PycassaLogger
@@ -67,6 +73,8 @@ from thrift.transport.TTransport import TTransportException
 
 SEEK_BACK_THRESHOLD = 2592000000 # 30 days in ms
 KEY_DELIMITER = ":"
+# number of distinct row keys interned by get_rowkey()
+ROWKEY_CACHE_SIZE = 100000
 AGG_TYPES = ['average', 'min', 'max', 'raw']
 
 class CassandraException(Exception):
@@ -87,6 +95,8 @@ class CASSANDRA_DB(object):
     stat_cf = 'stat_aggregations'
     
     _queue_size = 200
+    # Max number of columns requested per round trip by the range readers.
+    _page_size = 1000
     
     def __init__(self, config, qname=None, timeout=30):
         """
@@ -253,9 +263,18 @@ class CASSANDRA_DB(object):
         self.stats = DatabaseMetrics(profiling=self.profiling)
         
         # Class members
-        # Just the dict for the metadata cache.
-        self.metadata_cache = {}
-        self.aggregation_cache = {}
+        # The metadata and aggregation caches are bounded so memory use 
+        # does not keep growing with the number of paths seen.  Evicted 
+        # entries are re-seeded from the database when they come back.
+        self.metadata_cache = LRUCache(maxsize=config.metadata_cache_size)
+        self.aggregation_cache = LRUCache(maxsize=config.aggregation_cache_size)
+
+        # Thread pool used to read the rows of queries that span more 
+        # than one year concurrently.  The connection pool is thread safe.
+        self._fetch_pool = None
+        if config.cassandra_fetch_threads and config.cassandra_fetch_threads > 1:
+            self._fetch_pool = ThreadPoolExecutor(
+                max_workers=config.cassandra_fetch_threads)
         
     def flush(self):
         """
@@ -269,11 +288,23 @@ class CASSANDRA_DB(object):
         self.aggs.send()
         self.stat_agg.send()
         
+    def cache_stats(self):
+        """
+        Size and hit/miss/eviction counts of the metadata and aggregation
+        caches.
+        """
+        return {
+            'metadata_cache': self.metadata_cache.stats(),
+            'aggregation_cache': self.aggregation_cache.stats(),
+        }
+
     def close(self):
         """
         Explicitly close the connection pool.
         """
         self.log.debug('Close/dispose called')
+        if self._fetch_pool:
+            self._fetch_pool.shutdown(wait=False)
         self.pool.dispose()
         
     def set_raw_data(self, raw_data, ttl=None):
@@ -319,8 +350,9 @@ class CASSANDRA_DB(object):
         t = time.time()
 
         meta_d = None
+        meta_doc = self.metadata_cache.get(raw_data.get_meta_key())
         
-        if raw_data.get_meta_key() not in self.metadata_cache:
+        if meta_doc is None:
             # Didn't find a value in the metadata cache.  First look
             # back through the raw data for SEEK_BACK_THRESHOLD seconds
             # to see if we can find the last processed value.
@@ -355,7 +387,7 @@ class CASSANDRA_DB(object):
                         (raw_data.get_meta_key(), raw_data))
             self.set_metadata(raw_data.get_meta_key(), meta_d)
         else:
-            meta_d = Metadata(**self.metadata_cache[raw_data.get_meta_key()])
+            meta_d = Metadata(**meta_doc)
         
         return meta_d
         
@@ -367,8 +399,13 @@ class CASSANDRA_DB(object):
         The metadata arg is a Metadata object defined in this module.
         """
         t = time.time()
+        meta_doc = self.metadata_cache.get(k)
+        if meta_doc is None:
+            # evicted since it was looked up
+            self.set_metadata(k, metadata)
+            return
         for i in ['last_val', 'min_ts', 'last_update']:
-            self.metadata_cache[k][i] = getattr(metadata, i)
+            meta_doc[i] = getattr(metadata, i)
         #self.stats.meta_update((time.time() - t))
     
     def update_rate_bin(self, ratebin):
@@ -559,6 +596,124 @@ class CASSANDRA_DB(object):
             key_range.append(get_rowkey(path, freq=freq, year=year_start))
         return key_range
 
+    def _iter_columns(self, cf, row_keys, ts_min, ts_max, column_count=None):
+        """
+        Utility generator used by the query interface.
+
+        Reads the columns between ts_min and ts_max from the row keys, 
+        asking for at most _page_size columns per request and resuming 
+        from the last column seen until the row is exhausted or 
+        column_count columns have been returned.  This way a range query
+        is a single scan of the data rather than a multiget_count pass 
+        followed by a multiget sized from the count.
+
+        When the range spans more than one row (ie: year) the rows are 
+        combined with a streaming k-way merge on the column names so the
+        results are always in time order, holding no more than a page 
+        per row.  The first page of every row is requested concurrently
+        on the fetch thread pool, so a multi-year query waits for the 
+        slowest row once rather than for every row in turn.
+
+        The cf arg is a raw pycassa ColumnFamily (ie: not the batch).
+
+        Yields (row_key, column_name, column_value) tuples in column 
+        name order.
+        """
+        count = self._page_size
+        if column_count is not None:
+            count = min(count, column_count)
+
+        first_pages = {}
+        if self._fetch_pool and len(row_keys) > 1:
+            for key in row_keys:
+                first_pages[key] = self._fetch_pool.submit(self._get_page,
+                        cf, key, ts_min, ts_max, count)
+
+        rows = [self._iter_row(cf, key, ts_min, ts_max, column_count, 
+            first_pages.get(key)) for key in row_keys]
+        if len(rows) == 1:
+            merged = rows[0]
+        else:
+            merged = heapq.merge(*rows, key=operator.itemgetter(1))
+
+        try:
+            for col in itertools.islice(merged, column_count):
+                yield col
+        finally:
+            # Don't leave reads running for rows that aren't needed.
+            for f in list(first_pages.values()):
+                f.cancel()
+
+    def _iter_row(self, cf, key, ts_min, ts_max, column_count=None, first_page=None):
+        """
+        Utility generator used by _iter_columns() - pages through the 
+        columns of a single row.  The first_page arg is an optional future 
+        for the first page (sized for the whole column_count).
+        """
+        remaining = column_count
+        start = ts_min
+
+        while remaining is None or remaining > 0:
+            count = self._page_size
+            if remaining is not None:
+                count = min(count, remaining)
+            if first_page is not None:
+                page = first_page.result()
+                first_page = None
+            else:
+                page = self._get_page(cf, key, start, ts_max, count)
+
+            for name, value in page.items():
+                yield key, name, value
+
+            if remaining is not None:
+                remaining -= len(page)
+            if len(page) < count:
+                # Short page - the row is exhausted.
+                break
+            # Column names are LONG_TYPE so resume just past the
+            # last column returned.
+            start = next(reversed(page)) + 1
+
+    def _get_page(self, cf, key, column_start, column_finish, column_count):
+        """
+        Read a slice of a row, an empty OrderedDict if the row does not
+        exist or has nothing in the range.
+        """
+        try:
+            return cf.get(key, column_start=column_start,
+                    column_finish=column_finish, column_count=column_count)
+        except NotFoundException:
+            return OrderedDict()
+
+    def get_existing_columns(self, col_fam, columns_by_key):
+        """
+        Utility function used to check which of a set of columns have 
+        already been written, with a single multiget.
+
+        The columns_by_key arg maps row keys to lists of column names (ie:
+        timestamps in ms) to look for.  Returns a dict mapping the row keys
+        that had any of them to the set of columns found.  The col_fam arg
+        is one of the keys in self.cf_map.
+        """
+        if not columns_by_key:
+            return {}
+
+        columns = set()
+        for cols in list(columns_by_key.values()):
+            columns.update(cols)
+
+        ret = self.cf_map[col_fam]._column_family.multiget(
+                list(columns_by_key.keys()), columns=sorted(columns))
+
+        found = {}
+        for k,v in list(ret.items()):
+            hits = set(v.keys()) & set(columns_by_key[k])
+            if hits:
+                found[k] = hits
+
+        return found
+
     def check_for_valid_keys(self, path=None, freq=None, 
             ts_min=None, ts_max=None, col_fam='rate'):
         """
@@ -582,27 +737,26 @@ class CASSANDRA_DB(object):
 
         return found
         
-    def query_baserate_timerange(self, path=None, freq=None, 
+    def iter_baserate_timerange(self, path=None, freq=None, 
             ts_min=None, ts_max=None, cf='average', column_count=None):
         """
-        Query interface method to retrieve the base rates (generally average 
-        but could be delta as well).
+        Generator version of query_baserate_timerange() - yields the 
+        result dicts one at a time as the pages are read from cassandra
+        so callers can stream large ranges without building a list.
         """
-        cols = column_count
-        if cols is None:
-            ret_count = self.rates._column_family.multiget_count(
-                self._get_row_keys(path,freq,ts_min,ts_max), 
-                column_start=ts_min, column_finish=ts_max)
-            cols = 0
-            for i in list(ret_count.keys()):
-                cols += ret_count[i]
-            cols += 5
-
-        ret = self.rates._column_family.multiget(
-                self._get_row_keys(path,freq,ts_min,ts_max), 
-                column_start=ts_min, column_finish=ts_max,
-                column_count=cols)
+        decode = self._baserate_decoder(freq, cf)
+
+        ret = self._iter_columns(self.rates._column_family,
+                self._get_row_keys(path,freq,ts_min,ts_max),
+                ts_min, ts_max, column_count)
         
+        for k,kk,vv in ret:
+            yield decode(kk, vv)
+
+    def _baserate_decoder(self, freq, cf):
+        """
+        Returns a function that turns a base rate column into a result dict.
+        """
         if cf not in ['average', 'delta']:
             self.log.error('Not a valid option: %s - defaulting to average' % cf)
             cf = 'average'
@@ -610,125 +764,224 @@ class CASSANDRA_DB(object):
         # Divisors to return either the average or a delta.
         if freq is None: freq = 1000
         value_divisors = { 'average': int(freq/1000), 'delta': 1 }
-        
+
+        def decode(kk, vv):
+            return {'ts': kk, 'val': float(vv[b'val']) / value_divisors[cf], 
+                    'is_valid': vv[b'is_valid']}
+
+        return decode
+
+    def query_baserate_timerange(self, path=None, freq=None, 
+            ts_min=None, ts_max=None, cf='average', column_count=None):
+        """
+        Query interface method to retrieve the base rates (generally average 
+        but could be delta as well).
+        """
         # Just return the results and format elsewhere.
-        results = []
-        
-        for k,v in list(ret.items()):
-            for kk,vv in list(v.items()):
-                results.append({'ts': kk, 'val': float(vv[b'val']) / value_divisors[cf], 
-                                        'is_valid': vv[b'is_valid']})
-            
-        return results
+        return list(self.iter_baserate_timerange(path=path, freq=freq,
+                ts_min=ts_min, ts_max=ts_max, cf=cf, column_count=column_count))
 
-    def query_aggregation_timerange(self, path=None, freq=None, 
+    def iter_aggregation_timerange(self, path=None, freq=None, 
                 ts_min=None, ts_max=None, cf=None, column_count=None):
         """
-        Query interface method to retrieve the aggregation rollups - could
-        be average/min/max.  Different column families will be queried 
-        depending on what value "cf" is set to.
+        Generator version of query_aggregation_timerange().
+        """
+        col_fam, decode = self._aggregation_decoder(cf)
+
+        ret = self._iter_columns(self.cf_map[col_fam]._column_family,
+                self._get_row_keys(path,freq,ts_min,ts_max),
+                ts_min, ts_max, column_count)
+
+        for k,kk,vv in ret:
+            yield decode(kk, vv)
+
+    def _aggregation_decoder(self, cf):
+        """
+        Returns the column family (a key in self.cf_map) that holds the
+        cf aggregations and a function that turns one of its columns into
+        a result dict.
         """
-                
         if cf not in AGG_TYPES:
             self.log.error('Not a valid option: %s - defaulting to average' % cf)
             cf = 'average'
         
         if cf == 'average' or cf == 'raw':
-            cols = column_count
-            if cols is None:
-                ret_count = self.aggs._column_family.multiget_count(
-                        self._get_row_keys(path,freq,ts_min,ts_max),
-                        column_start=ts_min, column_finish=ts_max)
-                cols = 0
-                for i in list(ret_count.keys()):
-                    cols += ret_count[i]
-                cols += 5
-
-            # print cols
-            ret = self.aggs._column_family.multiget(
-                    self._get_row_keys(path,freq,ts_min,ts_max), 
-                    column_start=ts_min, column_finish=ts_max,
-                    column_count=cols)
-
-            # Just return the results and format elsewhere.
-            results = []
-            
-            for k,v in list(ret.items()):
-                for kk,vv in list(v.items()):
-                    ts = kk
-                    val = None
-                    base_freq = None
-                    count = None
-                    for kkk in list(vv.keys()):
-                        if kkk == b'val':
-                            val = vv[kkk]
-                        else:
-                            base_freq = kkk
-                            count = vv[kkk]
-                    ab = AggregationBin(**{'ts': ts, 'val': val,'base_freq': int(base_freq), 'count': count, 'cf': cf})
-                    if cf == 'average':
-                        datum = {'ts': ts, 'val': ab.average, 'cf': ab.cf}
+            def decode(kk, vv):
+                ts = kk
+                val = None
+                base_freq = None
+                count = None
+                for kkk in list(vv.keys()):
+                    if kkk == b'val':
+                        val = vv[kkk]
                     else:
-                        datum = {'ts': ts, 'val': ab.val, 'cf': ab.cf}
-                    results.append(datum)
-        elif cf == 'min' or cf == 'max':
-            cols = column_count
-            if cols is None:
-                ret_count = self.stat_agg._column_family.multiget_count(
-                        self._get_row_keys(path,freq,ts_min,ts_max),
-                        column_start=ts_min, column_finish=ts_max)
-                cols = 0
-                for i in list(ret_count.keys()):
-                    cols += ret_count[i]
-                cols += 5
-
-            ret = self.stat_agg._column_family.multiget(
-                    self._get_row_keys(path,freq,ts_min,ts_max), 
-                    column_start=ts_min, column_finish=ts_max,
-                    column_count=cols)
-            
-            results = []
-
-            for k,v in list(ret.items()):
-                for kk,vv in list(v.items()):
-                    ts = kk
-                    if cf == 'min':
-                        datum = {'ts': ts, 'val': vv['min'], 'cf': cf, 'm_ts': vv.get('min_ts', None)}
-                        results.append(datum)
-                    else:
-                        datum = {'ts': ts, 'val': vv['max'], 'cf': cf, 'm_ts': vv.get('max_ts', None)}
-                        results.append(datum)
-        
-        return results
+                        base_freq = kkk
+                        count = vv[kkk]
+                ab = AggregationBin(**{'ts': ts, 'val': val,'base_freq': int(base_freq), 'count': count, 'cf': cf})
+                if cf == 'average':
+                    return {'ts': ts, 'val': ab.average, 'cf': ab.cf}
+                else:
+                    return {'ts': ts, 'val': ab.val, 'cf': ab.cf}
+            return 'aggs', decode
+        else:
+            def decode(kk, vv):
+                return {'ts': kk, 'val': vv[cf], 'cf': cf, 'm_ts': vv.get('%s_ts' % cf, None)}
+            return 'stat', decode
+
+    def query_aggregation_timerange(self, path=None, freq=None, 
+                ts_min=None, ts_max=None, cf=None, column_count=None):
+        """
+        Query interface method to retrieve the aggregation rollups - could
+        be average/min/max.  Different column families will be queried 
+        depending on what value "cf" is set to.
+        """
+        # Just return the results and format elsewhere.
+        return list(self.iter_aggregation_timerange(path=path, freq=freq,
+                ts_min=ts_min, ts_max=ts_max, cf=cf, column_count=column_count))
+
+    def iter_raw_data(self, path=None, freq=None,
+                ts_min=None, ts_max=None, column_count=None):
+        """
+        Generator version of query_raw_data().
+        """
+        ret = self._iter_columns(self.raw_data._column_family,
+                self._get_row_keys(path,freq,ts_min,ts_max),
+                ts_min, ts_max, column_count)
+
+        for k,kk,vv in ret:
+            yield self._decode_raw(kk, vv)
+
+    @staticmethod
+    def _decode_raw(kk, vv):
+        return {'ts': kk, 'val': json.loads(vv)}
             
     def query_raw_data(self, path=None, freq=None,
                 ts_min=None, ts_max=None, column_count=None):
         """
         Query interface to query the raw data.
         """
-        cols = column_count
-        if cols is None:
-            ret_count = self.raw_data._column_family.multiget_count(
-                    self._get_row_keys(path,freq,ts_min,ts_max),
-                    column_start=ts_min, column_finish=ts_max)
-            cols = 0
-            for i in list(ret_count.keys()):
-                cols += ret_count[i]
-            cols += 5
-
-        ret = self.raw_data._column_family.multiget(
-                self._get_row_keys(path,freq,ts_min,ts_max), 
-                column_start=ts_min, column_finish=ts_max,
-                column_count=cols)
-
         # Just return the results and format elsewhere.
-        results = []
+        return list(self.iter_raw_data(path=path, freq=freq,
+                ts_min=ts_min, ts_max=ts_max, column_count=column_count))
 
-        for k,v in list(ret.items()):
-            for kk,vv in list(v.items()):
-                results.append({'ts': kk, 'val': json.loads(vv)})
-        
-        return results
+    def query_timerange_bulk(self, queries, ts_min=None, ts_max=None, 
+                column_count=None):
+        """
+        Query interface to fetch the same time range for many paths at 
+        once (ie: a dashboard showing a mesh of tests).  The queries arg
+        is a list of (path, freq, cf) tuples where cf selects the data 
+        the same way as the single path methods:
+
+        'raw' - query_raw_data()
+        'average', 'delta' - query_baserate_timerange()
+        'agg_average', 'agg_min', 'agg_max', 'agg_raw' - 
+            query_aggregation_timerange() with cf='average', etc.
+
+        The rows of all the queries are read together with one multiget
+        per column family per round (see _multiget_round()) instead of a 
+        round trip per path.  Returns a list with the results of each 
+        query, in the same order as queries, each one limited to 
+        column_count values if that is given.
+        """
+        return list(self.iter_timerange_bulk(queries, ts_min=ts_min, 
+                ts_max=ts_max, column_count=column_count))
+
+    def iter_timerange_bulk(self, queries, ts_min=None, ts_max=None, 
+                column_count=None, chunk_size=None):
+        """
+        Generator version of query_timerange_bulk(), yields the results 
+        of each query in order.  The queries are read chunk_size at a 
+        time (all together if None) so only the results of one chunk are
+        held in memory.
+        """
+        reads = []
+        for path, freq, cf in queries:
+            if cf == 'raw':
+                col_fam, decode = 'raw', self._decode_raw
+            elif cf in ['average', 'delta']:
+                col_fam, decode = 'rate', self._baserate_decoder(freq, cf)
+            elif cf is not None and cf.startswith('agg_'):
+                col_fam, decode = self._aggregation_decoder(cf[len('agg_'):])
+            else:
+                raise CassandraException('Not a valid bulk query option: %s' % cf)
+            reads.append({
+                'col_fam': col_fam,
+                # Rows (years) left to read, earliest first.
+                'row_keys': self._get_row_keys(path,freq,ts_min,ts_max),
+                'start': ts_min,
+                'decode': decode,
+                'values': [],
+            })
+
+        chunk_size = chunk_size or len(reads) or 1
+        for i in range(0, len(reads), chunk_size):
+            chunk = reads[i:i + chunk_size]
+            pending = chunk
+            while pending:
+                pending = self._multiget_round(pending, ts_min, ts_max, 
+                    column_count)
+            for read in chunk:
+                yield read['values']
+
+    def _multiget_round(self, reads, ts_min, ts_max, column_count=None):
+        """
+        Utility function used by the bulk query interface.
+
+        Multiget version of _iter_columns(): reads the next page of every
+        one of reads, with one multiget for all the rows of a column 
+        family that resume from the same column.  Only the earliest row 
+        (year) left of a query is read and for no more columns than the 
+        query still needs, so the rows of later years are only read once
+        the earlier ones are exhausted and nothing is read past 
+        column_count values.  The decoded values are added to each read 
+        and the reads that need more are returned.
+        """
+        requests = {}
+        for read in reads:
+            count = self._page_size
+            if column_count is not None:
+                count = min(count, column_count - len(read['values']))
+            keys = requests.setdefault((read['col_fam'], read['start']), {})
+            key = read['row_keys'][0]
+            keys[key] = max(keys.get(key, 0), count)
+
+        pages = {}
+        for (col_fam, start), keys in list(requests.items()):
+            # Rows asking for different counts can't share a request.
+            by_count = {}
+            for k, count in list(keys.items()):
+                by_count.setdefault(count, []).append(k)
+            for count, row_keys in list(by_count.items()):
+                ret = self.cf_map[col_fam]._column_family.multiget(row_keys,
+                        column_start=start, column_finish=ts_max, 
+                        column_count=count)
+                for k in row_keys:
+                    pages[(col_fam, start, k)] = (ret.get(k, {}), count)
+
+        pending = []
+        for read in reads:
+            page, count = pages[(read['col_fam'], read['start'], read['row_keys'][0])]
+            values = read['values']
+            wanted = len(page)
+            if column_count is not None:
+                wanted = column_count - len(values)
+            for kk, vv in itertools.islice(page.items(), wanted):
+                values.append(read['decode'](kk, vv))
+            if column_count is not None and len(values) >= column_count:
+                continue
+            if len(page) < count:
+                # Short page - the row is exhausted, go on to the next.
+                read['row_keys'].pop(0)
+                if not read['row_keys']:
+                    continue
+                read['start'] = ts_min
+            else:
+                # Column names are LONG_TYPE so resume just past the
+                # last column returned.
+                read['start'] = next(reversed(page)) + 1
+            pending.append(read)
+
+        return pending
 
     def query_raw_first(self, path=None, freq=None, year=None):
         """
@@ -881,16 +1134,66 @@ class DatabaseMetrics(object):
 # in an object and provide utility methods and properties to convert 
 # timestampes, calculate averages, etc.
         
+class _Timestamp(object):
+    """
+    Descriptor for the timestamp attributes of the containers below.  A 
+    timestamp given as an integer JavaScript timestamp (milliseconds since 
+    the epoch) is stored as is and only turned into a datetime if that is 
+    asked for, so values read from cassandra or the persist queue never go 
+    through datetime just to be turned back into column names.  Datetimes
+    are stored as given and their JavaScript timestamp is worked out once.
+    """
+    def __init__(self, name):
+        self.dt = '_%s' % name
+        self.ms = '_%s_ms' % name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        dt = getattr(obj, self.dt)
+        if dt is None:
+            ms = getattr(obj, self.ms)
+            if ms is not None:
+                dt = datetime.datetime.utcfromtimestamp(ms/1000.0)
+                setattr(obj, self.dt, dt)
+        return dt
+
+    def __set__(self, obj, value):
+        if type(value) == int:
+            setattr(obj, self.dt, None)
+            setattr(obj, self.ms, value)
+        else:
+            if value is not None and type(value) != datetime.datetime:
+                value = datetime.datetime.utcfromtimestamp(float(value)/1000.0)
+            setattr(obj, self.dt, value)
+            setattr(obj, self.ms, None)
+        # the row key may include the year
+        obj._key = None
+
+    def jstime(self, obj):
+        ms = getattr(obj, self.ms)
+        if ms is None:
+            ms = calendar.timegm(getattr(obj, self.dt).utctimetuple()) * 1000
+            setattr(obj, self.ms, ms)
+        return ms // 1000 * 1000
+
 class DataContainerBase(object):
     """
     Base class for the other encapsulation objects.  Mostly provides 
     utility methods for subclasses.
+
+    One of these is created for every value going in or out of cassandra
+    so they use __slots__, keep timestamps in the form they were given (see
+    _Timestamp) and only build their row key once.
     """
     
+    __slots__ = ['path', '_key']
+    _doc_fields = ['path']
     _doc_properties = []
     
     def __init__(self, path):
         self.path = path
+        self._key = None
         
     def _handle_date(self,d):
         """
@@ -907,10 +1210,8 @@ class DataContainerBase(object):
         Return a dictionary of the attrs/props in the object.
         """
         doc = {}
-        for k,v in list(self.__dict__.items()):
-            if k.startswith('_'):
-                continue
-            doc[k] = v
+        for k in self._doc_fields:
+            doc[k] = getattr(self, k)
             
         for p in self._doc_properties:
             doc[p] = getattr(self, '%s' % p)
@@ -921,6 +1222,11 @@ class DataContainerBase(object):
         """
         Return a cassandra row key based on the contents of the object.
         """
+        if self._key is None:
+            self._key = self._build_key()
+        return self._key
+
+    def _build_key(self):
         return get_rowkey(self.path)
         
     def ts_to_jstime(self, t='ts'):
@@ -930,8 +1236,7 @@ class DataContainerBase(object):
         Defaults to returning 'ts' property, but can be given an arg to grab a
         different property/attribute like Metadata.last_update.
         """
-        ts = getattr(self, t)
-        return calendar.timegm(ts.utctimetuple()) * 1000
+        return getattr(type(self), t).jstime(self)
 
     def ts_to_unixtime(self, t='ts'):
         """
@@ -939,8 +1244,7 @@ class DataContainerBase(object):
         Defaults to returning 'ts' property, but can be given an arg to grab a
         different property/attribute like Metadata.last_update.
         """
-        ts = getattr(self, t)
-        return calendar.timegm(ts.utctimetuple())
+        return self.ts_to_jstime(t) // 1000
 
 class RawData(DataContainerBase):
     """
@@ -949,15 +1253,18 @@ class RawData(DataContainerBase):
     Can be instantiated from args when reading from persist queue, or via **kw
     when reading data back out of Cassandra.
     """
+    __slots__ = ['_ts', '_ts_ms', 'val']
+    _doc_fields = ['path', 'val']
     _doc_properties = ['ts']
 
+    ts = _Timestamp('ts')
+
     def __init__(self, path=None, ts=None, val=None):
         DataContainerBase.__init__(self, path)
-        self._ts = None
         self.ts = ts
         self.val = val
 
-    def get_key(self):
+    def _build_key(self):
         """
         Return a cassandra row key based on the contents of the object.
 
@@ -967,24 +1274,19 @@ class RawData(DataContainerBase):
         """
         return get_rowkey(self.path, year=self.ts.year)
 
-    @property
-    def ts(self):
-        return self._ts
-        
-    @ts.setter
-    def ts(self, value):
-        self._ts = self._handle_date(value)
-
 
 class RawRateData(RawData):
     """
     Container for raw data for rate based rows.
     """
+    __slots__ = ['freq', '_meta_key']
+    _doc_fields = ['path', 'val', 'freq']
     _doc_properties = ['ts']
 
     def __init__(self, path=None, ts=None, val=None, freq=None):
         RawData.__init__(self, path, ts, val)
         self.freq = freq
+        self._meta_key = None
 
     def __unicode__(self):
         return "<RawRateData/%d: ts=%s, val=%s, path=%s>" % \
@@ -994,7 +1296,7 @@ class RawRateData(RawData):
         return "<RawRateData/%d: ts=%s, val=%s, path=%s>" % \
             (id(self), self.ts, self.val, self.path)
 
-    def get_key(self):
+    def _build_key(self):
         """
         Return a cassandra row key based on the contents of the object.
 
@@ -1008,7 +1310,9 @@ class RawRateData(RawData):
         Get a "metadata row key" - metadata don't have timestamps/years.
         Other objects use this to look up entires in the metadata_cache.
         """
-        return get_rowkey(self.path, freq=self.freq)
+        if self._meta_key is None:
+            self._meta_key = get_rowkey(self.path, freq=self.freq)
+        return self._meta_key
         
     @property
     def min_last_update(self):
@@ -1024,11 +1328,16 @@ class Metadata(DataContainerBase):
     Container for metadata information.
     """
     
+    __slots__ = ['_min_ts', '_min_ts_ms', '_last_update', '_last_update_ms', 
+        'last_val', 'freq']
+    _doc_fields = ['path', 'last_val', 'freq']
     _doc_properties = ['min_ts', 'last_update']
+
+    min_ts = _Timestamp('min_ts')
+    last_update = _Timestamp('last_update')
     
     def __init__(self, path=None, last_update=None, last_val=None, min_ts=None, freq=None):
         DataContainerBase.__init__(self, path)
-        self._min_ts = self._last_update = None
         self.last_update = last_update
         self.last_val = last_val
         self.min_ts = min_ts
@@ -1042,22 +1351,6 @@ class Metadata(DataContainerBase):
         return "<Metadata/%d: last_update=%s, last_val=%s, min_ts=%s, freq=%s>" % \
             (id(self), self.last_update, self.last_val, self.min_ts, self.freq)
         
-    @property
-    def min_ts(self):
-        return self._min_ts
-        
-    @min_ts.setter
-    def min_ts(self, value):
-        self._min_ts = self._handle_date(value)
-    
-    @property
-    def last_update(self):
-        return self._last_update
-        
-    @last_update.setter
-    def last_update(self, value):
-        self._last_update = self._handle_date(value)
-        
     def refresh_from_raw(self, data):
         """
         Update the internal state of a metadata object from a raw data
@@ -1076,6 +1369,8 @@ class BaseRateBin(RawRateData):
     Container for base rates.  Has 'average' property to return the averages.
     """
     
+    __slots__ = ['is_valid']
+    _doc_fields = ['path', 'val', 'freq', 'is_valid']
     _doc_properties = ['ts']
     
     def __init__(self, path=None, ts=None, val=None, freq=None, is_valid=1):
@@ -1092,6 +1387,9 @@ class AggregationBin(BaseRateBin):
     Container for aggregation rollups.  Also has 'average' property to generage averages.
     """
     
+    __slots__ = ['count', 'min', 'max', 'base_freq', 'cf']
+    _doc_fields = ['path', 'val', 'freq', 'is_valid', 'count', 'min', 'max', 'base_freq', 'cf']
+    
     def __init__(self, path=None, ts=None, val=None, freq=None, base_freq=None, count=None, 
             min=None, max=None, cf=None):
         BaseRateBin.__init__(self, path, ts, val, freq)
@@ -1120,9 +1418,14 @@ def get_rowkey(path, freq=None, year=None):
 
     The freq and year arguments are used for internal book keeping inside
     Cassandra.
-    """
 
+    The same handful of paths are used over and over by the persister and
+    the REST interface so the keys are interned, see _build_rowkey.
+    """
+    return _build_rowkey(tuple(path), freq, year)
 
+@functools.lru_cache(maxsize=ROWKEY_CACHE_SIZE)
+def _build_rowkey(path, freq, year):
     appends = []
     if freq:
         appends.append(str(freq))
@@ -1131,6 +1434,8 @@ def get_rowkey(path, freq=None, year=None):
 
     return KEY_DELIMITER.join(escape_path(path) + appends)
 
+_ROWKEY_SPLIT = {}
+
 def _split_rowkey(s, escape='\\'):
     """
     Return the elements of the rowkey taking escaping into account.
@@ -1138,21 +1443,23 @@ def _split_rowkey(s, escape='\\'):
     FOR INTERNAL USE ONLY!  This returns more than just the path in most
     instances and needs to be used with specific knowledge of what kind of row
     key is used.
+
+    Splits on every delimiter that isn't preceded by the escape character
+    (a leading delimiter always splits) and strips the escape characters
+    from all but the last element.
     """
-    indices = []
-
-    for i in range(len(s)):
-        if s[i] == KEY_DELIMITER:
-            if i > 0 and s[i-1] != escape:
-                indices.append(i)
-            elif i == 0:
-                indices.append(i)
-
-    out = []
-    last = 0
-    for i in indices:
-        out.append(s[last:i].replace(escape, ""))
-        last = i+1
-    out.append(s[last:])
+    if escape not in s:
+        return s.split(KEY_DELIMITER)
+
+    try:
+        split = _ROWKEY_SPLIT[escape]
+    except KeyError:
+        split = _ROWKEY_SPLIT[escape] = re.compile('(?<!%s)%s' % (
+            re.escape(escape), re.escape(KEY_DELIMITER))).split
+
+    out = split(s)
+    last = out.pop()
+    out = [x.replace(escape, "") for x in out]
+    out.append(last)
 
     return out
@@ -48,11 +48,13 @@ class EsmondConfig(object):
         self.file = file
 
         self.agg_tsdb_root = None
+        self.aggregation_cache_size = 100000
         self.allowed_hosts = []
         self.api_anon_limit = None
         self.api_throttle_at = None
         self.api_throttle_timeframe = None
         self.api_throttle_expiration = None
+        self.cassandra_fetch_threads = 4
         self.cassandra_keyspace = 'esmond'
         self.cassandra_pass = None
         self.cassandra_servers = []
@@ -63,6 +65,11 @@ class EsmondConfig(object):
         self.db_clear_on_testing = False
         self.db_profile_on_testing = None
         self.debug = False
+        self.dns_cache_size = 10000
+        self.dns_cache_ttl = 300
+        self.dns_lookup_threads = 4
+        self.dns_lookup_timeout = 5
+        self.dns_negative_cache_ttl = 60
         self.error_email_from = None
         self.error_email_subject = None
         self.error_email_to = None
@@ -70,6 +77,7 @@ class EsmondConfig(object):
         self.espersistd_uri = None
         self.espoll_persist_uri = None
         self.htpasswd_file = None
+        self.metadata_cache_size = 100000
         self.mib_dirs = []
         self.mibs = []
         self.pid_dir = None
@@ -86,8 +94,17 @@ class EsmondConfig(object):
         self.sql_db_port = ''
         self.sql_db_user = ''
         self.streaming_log_dir = None
+        self.summary_cache_backend = 'django.core.cache.backends.locmem.LocMemCache'
+        self.summary_cache_location = ''
+        self.summary_cache_size = 100000
+        self.summary_cache_ttl = 300
         self.syslog_facility = None
         self.syslog_priority = None
+        self.time_updated_max_delay = 0
+        self.timeseries_cache_backend = ''
+        self.timeseries_cache_location = ''
+        self.timeseries_cache_settle = 3600
+        self.timeseries_cache_ttl = 86400
         self.traceback_dir = None
         self.tsdb_chunk_prefixes = None
         self.tsdb_root = None
@@ -109,17 +126,24 @@ class EsmondConfig(object):
         config_items = [x[0] for x in cfg.items("main")]
         for opt in (
                 'agg_tsdb_root',
+                'aggregation_cache_size',
                 'allowed_hosts',
                 'api_anon_limit',
                 'api_throttle_at',
                 'api_throttle_timeframe',
                 'api_throttle_expiration',
+                'cassandra_fetch_threads',
                 'cassandra_pass',
                 'cassandra_servers',
                 'cassandra_user',
                 'db_profile_on_testing',
                 'db_uri',
                 'debug',
+                'dns_cache_size',
+                'dns_cache_ttl',
+                'dns_lookup_threads',
+                'dns_lookup_timeout',
+                'dns_negative_cache_ttl',
                 'error_email_from',
                 'error_email_subject',
                 'error_email_to',
@@ -127,6 +151,7 @@ class EsmondConfig(object):
                 'espersistd_uri',
                 'espoll_persist_uri',
                 'htpasswd_file',
+                'metadata_cache_size',
                 'mib_dirs',
                 'mibs',
                 'pid_dir',
@@ -142,8 +167,17 @@ class EsmondConfig(object):
                 'sql_db_port',
                 'sql_db_user',
                 'streaming_log_dir',
+                'summary_cache_backend',
+                'summary_cache_location',
+                'summary_cache_size',
+                'summary_cache_ttl',
                 'syslog_facility',
                 'syslog_priority',
+                'time_updated_max_delay',
+                'timeseries_cache_backend',
+                'timeseries_cache_location',
+                'timeseries_cache_settle',
+                'timeseries_cache_ttl',
                 'traceback_dir',
                 'tsdb_chunk_prefixes',
                 'tsdb_root',
@@ -189,6 +223,8 @@ class EsmondConfig(object):
             self.mibs = list(map(str.strip, self.mibs.split(',')))
         if self.cassandra_servers:
             self.cassandra_servers = list(map(str.strip, self.cassandra_servers.split(',')))
+        if self.cassandra_fetch_threads:
+            self.cassandra_fetch_threads = int(self.cassandra_fetch_threads)
         if self.poll_timeout:
             self.poll_timeout = int(self.poll_timeout)
         if self.poll_retries:
@@ -203,6 +239,30 @@ class EsmondConfig(object):
             self.api_throttle_timeframe = int(self.api_throttle_timeframe)
         if self.api_throttle_expiration:
             self.api_throttle_expiration = int(self.api_throttle_expiration)
+        if self.aggregation_cache_size:
+            self.aggregation_cache_size = int(self.aggregation_cache_size)
+        if self.metadata_cache_size:
+            self.metadata_cache_size = int(self.metadata_cache_size)
+        if self.dns_cache_size:
+            self.dns_cache_size = int(self.dns_cache_size)
+        if self.dns_cache_ttl:
+            self.dns_cache_ttl = int(self.dns_cache_ttl)
+        if self.dns_lookup_threads:
+            self.dns_lookup_threads = int(self.dns_lookup_threads)
+        if self.dns_lookup_timeout:
+            self.dns_lookup_timeout = int(self.dns_lookup_timeout)
+        if self.dns_negative_cache_ttl:
+            self.dns_negative_cache_ttl = int(self.dns_negative_cache_ttl)
+        if self.summary_cache_size:
+            self.summary_cache_size = int(self.summary_cache_size)
+        if self.summary_cache_ttl:
+            self.summary_cache_ttl = int(self.summary_cache_ttl)
+        if self.time_updated_max_delay:
+            self.time_updated_max_delay = int(self.time_updated_max_delay)
+        if self.timeseries_cache_settle:
+            self.timeseries_cache_settle = int(self.timeseries_cache_settle)
+        if self.timeseries_cache_ttl:
+            self.timeseries_cache_ttl = int(self.timeseries_cache_ttl)
 
 
 
@@ -41,6 +41,28 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Summaries configured for each event type, looked up on every write
+    # (see get_summaries). This needs a backend shared by all processes 
+    # (ie: memcached) so a change in one process is seen by the others.
+    'summaries': {
+        'BACKEND': ESMOND_SETTINGS.summary_cache_backend,
+        'LOCATION': ESMOND_SETTINGS.summary_cache_location,
+        'OPTIONS': {
+            'MAX_ENTRIES': ESMOND_SETTINGS.summary_cache_size,
+        },
+    },
+    # Responses for time ranges that are in the past, off unless a backend
+    # is configured. Use one shared by all processes (ie: memcached).
+    'timeseries': {
+        'BACKEND': ESMOND_SETTINGS.timeseries_cache_backend or 'django.core.cache.backends.dummy.DummyCache',
+        'LOCATION': ESMOND_SETTINGS.timeseries_cache_location,
+    },
+}
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
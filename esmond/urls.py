@@ -29,6 +29,8 @@ urlpatterns = [
     ## URL definitions for V2 Perfsonar API
     # main archive/metadata endpoint.
     url(r'{0}/'.format(PS_ROOT), include(ps_router.urls)),
+    # bulk timeseries data endpoint.
+    url(r'{0}/timeseries/?$'.format(PS_ROOT), TimeSeriesViewset.as_view({'get': 'bulk_retrieve'})),
     # event type detail endpoint.
     url(r'{0}/archive/(?P<metadata_key>[\w\d_.-]+)/(?P<event_type>[\w\d_.-]+)/?$'.format(PS_ROOT), EventTypeDetailViewset.as_view({'post': 'create', 'get': 'retrieve'})),
     # timeseries data endpoint.
@@ -1,7 +1,9 @@
 import ctypes
 import datetime
+import threading
 import time
 import logging
+from collections import OrderedDict
 
 from django.utils.timezone import utc, make_aware
 
@@ -50,3 +52,95 @@ def datetime_to_unixtime(dt):
 # that this datetime is effectively infinite.  it is set to be 2 days less than
 # datetime.datetime.max to prevent overflow due to timezone variances.
 max_datetime = make_aware(datetime.datetime.max - datetime.timedelta(2), utc)
+
+class LRUCache(object):
+    """
+    Bounded dict-like cache. Holds at most maxsize entries and evicts the 
+    least recently used one to make room for a new one. If ttl (seconds) is
+    set, entries also expire that long after they were stored; set() can 
+    override it per entry. Lookups through get() are counted as hits or 
+    misses, and evictions and expirations are counted too, so caches can be 
+    sized from stats(). Safe to share between threads.
+    """
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] < time.time():
+            del self._data[key]
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = None
+        if ttl is not None:
+            expires = time.time() + ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry[1]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def __len__(self):
+        return len(self._data)
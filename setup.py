@@ -18,6 +18,7 @@ setup(
         'djangorestframework~=3.9.4',
         'drf-extensions~=0.4.0',
         'djangorestframework-filters~=0.10.2',
+        'numpy',
         'django-filter~=1.1',
         'python-memcached>=1.57',
         'psycopg2>=2.7.7',
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmark for the data containers in esmond.cassandra.
+
+Measures the CPU time and memory allocated per data point for the work the
+persister and the REST interface do with every value: build a container,
+get its row key and the column name (JavaScript timestamp). Building and
+splitting a row key on its own is timed as well. Run it before and after
+changing the containers to compare, e.g.:
+
+    python3 util/bench_containers.py -n 200000
+"""
+
+import argparse
+import datetime
+import timeit
+import tracemalloc
+
+from esmond.cassandra import RawRateData, BaseRateBin, AggregationBin, Metadata, get_rowkey, _split_rowkey
+
+PATH = ['ps', 'packet_count_sent', '0CB19291FB6D40EAA1955376772BF5D2']
+START_MS = 1391549015000
+
+def raw_rate_data(i):
+    # persister: values come off the queue with ms timestamps
+    d = RawRateData(path=PATH, ts=START_MS + i * 1000, val=i, freq=30000)
+    return d.get_key(), d.get_meta_key(), d.ts_to_jstime()
+
+def base_rate_bin(i):
+    # perfsonar api: values come in with datetimes
+    d = BaseRateBin(path=PATH, ts=datetime.datetime.utcfromtimestamp(START_MS/1000 + i), val=i, freq=None)
+    return d.get_key(), d.ts_to_jstime(), d.ts_to_jstime()
+
+def aggregation_bin(i):
+    # query interface: one per column read to work out the average
+    d = AggregationBin(ts=START_MS + i * 1000, val=i, base_freq=30000, count=2, cf='average')
+    return d.average
+
+def metadata(i):
+    d = Metadata(path=PATH, last_update=START_MS + i * 1000, last_val=i, min_ts=START_MS, freq=30000)
+    return d.get_document()
+
+def rowkey(i):
+    return get_rowkey(PATH, freq=30000, year=2014)
+
+def split_rowkey(i):
+    return _split_rowkey('ps:packet_count_sent:0CB19291FB6D40EAA1955376772BF5D2:30000:2014')
+
+BENCHMARKS = [raw_rate_data, base_rate_bin, aggregation_bin, metadata]
+# not containers, so only timed
+KEY_BENCHMARKS = [rowkey, split_rowkey]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cassandra data containers")
+    parser.add_argument('-n', '--number', type=int, default=100000,
+        help="Number of data points per benchmark (default: 100000)")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+        help="Number of times to repeat each benchmark, the best is reported (default: 5)")
+    args = parser.parse_args()
+
+    print("%-20s %12s %14s" % ("benchmark", "usec/point", "bytes/object"))
+    for func in BENCHMARKS:
+        t = min(timeit.repeat(lambda: [func(i) for i in range(args.number)], number=1, repeat=args.repeat))
+        print("%-20s %12.3f %14.1f" % (func.__name__, t * 1e6 / args.number, object_size(func, args.number)))
+    for func in KEY_BENCHMARKS:
+        t = min(timeit.repeat(lambda: [func(i) for i in range(args.number)], number=1, repeat=args.repeat))
+        print("%-20s %12.3f %14s" % (func.__name__, t * 1e6 / args.number, "-"))
+
+def object_size(func, n):
+    """
+    Average memory allocated for one container as built from a data point,
+    before any key or timestamp is asked for.
+    """
+    ctor = {
+        'raw_rate_data': lambda i: RawRateData(path=PATH, ts=START_MS + i * 1000, val=i, freq=30000),
+        'base_rate_bin': lambda i: BaseRateBin(path=PATH, ts=datetime.datetime.utcfromtimestamp(START_MS/1000 + i), val=i),
+        'aggregation_bin': lambda i: AggregationBin(ts=START_MS + i * 1000, val=i, base_freq=30000, count=2, cf='average'),
+        'metadata': lambda i: Metadata(path=PATH, last_update=START_MS + i * 1000, last_val=i, min_ts=START_MS, freq=30000),
+    }[func.__name__]
+    tracemalloc.start()
+    objs = [ctor(i) for i in range(n)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / float(n)
+
+if __name__ == '__main__':
+    main()
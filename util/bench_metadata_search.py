@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of archive metadata searches using the metadata search index
+(ps_metadata_search) against the joins over the subject, parameter and event
+type tables that were used before.
+
+Generates a dataset of the given number of point-to-point metadata objects,
+each with event types and parameters like the ones perfSONAR testers
+register, then times a set of typical searches both ways. Everything is
+done in a transaction that is rolled back at the end so the database is
+left as it was, but use a test database since it still takes locks and
+space while running. Needs DJANGO_SETTINGS_MODULE set like the other
+utilities, e.g.:
+
+    DJANGO_SETTINGS_MODULE=esmond.settings python3 util/bench_metadata_search.py -n 1000000
+"""
+
+#init django -must happen before other imports
+import django
+django.setup()
+
+import argparse
+import hashlib
+import random
+import time
+
+from django.db import connection, transaction
+from django.db.models import Max, Q
+
+from esmond.api.models import (PSMetadata, PSPointToPointSubject, PSEventTypes,
+    PSMetadataParameters, PSMetadataSearch)
+from esmond.api.perfsonar.search import SEARCH_KIND_SUBJECT, SEARCH_KIND_PARAMETER, search_filter, value_digest
+
+TOOLS = ['bwctl/iperf3', 'pscheduler/iperf3', 'powstream', 'pscheduler/traceroute', 'pscheduler/ping']
+EVENT_TYPES = ['throughput', 'packet-loss-rate', 'histogram-owdelay', 'packet-trace', 'failures']
+PARAMETERS = {
+    'time-interval': ['3600', '7200', '14400', '21600'],
+    'time-duration': ['10', '20', '30'],
+    'ip-transport-protocol': ['tcp', 'udp'],
+    'bw-parallel-streams': ['1', '2', '4', '8'],
+}
+
+class Rollback(Exception):
+    pass
+
+def host(i):
+    return '10.%d.%d.%d' % (i // 65536 % 256, i // 256 % 256, i % 256)
+
+def search_row(md, kind, field, value):
+    return PSMetadataSearch(metadata=md, kind=kind, field=field, value=value, digest=value_digest(value))
+
+def generate(num_metadata, num_hosts, batch_size):
+    """
+    Insert num_metadata metadata objects with subjects between num_hosts
+    hosts, along with their rows in the search index.
+    """
+    next_id = (PSMetadata.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+    last_id = next_id + num_metadata
+    for start in range(next_id, last_id, batch_size):
+        metadata = []
+        subjects = []
+        event_types = []
+        parameters = []
+        search_rows = []
+        for i in range(start, min(start + batch_size, last_id)):
+            md = PSMetadata(id=i, metadata_key='bench%027d' % i, subject_type='point-to-point',
+                checksum=hashlib.sha256(str(i).encode('utf-8')).hexdigest())
+            metadata.append(md)
+            src = host(random.randrange(num_hosts))
+            dst = host(random.randrange(num_hosts))
+            tool = random.choice(TOOLS)
+            subjects.append(PSPointToPointSubject(metadata=md, tool_name=tool, source=src, destination=dst,
+                measurement_agent=src, input_source=src, input_destination=dst))
+            for field, value in [('source', src), ('destination', dst), ('measurement-agent', src),
+                    ('input-source', src), ('input-destination', dst), ('tool-name', tool)]:
+                search_rows.append(search_row(md, SEARCH_KIND_SUBJECT, field, value))
+            for et in random.sample(EVENT_TYPES, 2):
+                event_types.append(PSEventTypes(metadata=md, event_type=et, summary_type='base', summary_window=0))
+            for k in sorted(PARAMETERS):
+                value = random.choice(PARAMETERS[k])
+                parameters.append(PSMetadataParameters(metadata=md, parameter_key=k, parameter_value=value))
+                search_rows.append(search_row(md, SEARCH_KIND_PARAMETER, k, value))
+        PSMetadata.objects.bulk_create(metadata)
+        PSPointToPointSubject.objects.bulk_create(subjects)
+        PSEventTypes.objects.bulk_create(event_types)
+        PSMetadataParameters.objects.bulk_create(parameters)
+        PSMetadataSearch.objects.bulk_create(search_rows)
+    if connection.vendor == 'postgresql':
+        connection.cursor().execute('ANALYZE')
+
+def join_queryset(subject_filters, parameter_filters, event_type):
+    """
+    The search as ArchiveViewset.get_queryset used to do it.
+    """
+    ret = PSMetadata.objects.all()
+    if event_type is not None:
+        ret = ret.filter(pseventtypes__event_type=event_type)
+    for k, v in parameter_filters:
+        ret = ret.filter(Q(psmetadataparameters__parameter_key=k, psmetadataparameters__parameter_value=v))
+    for k, v in subject_filters:
+        field = k.replace('-', '_')
+        ret = ret.filter(Q(**{'pspointtopointsubject__' + field: v}) | Q(**{'psnetworkelementsubject__' + field: v}))
+    return ret.distinct()
+
+def index_queryset(subject_filters, parameter_filters, event_type):
+    """
+    The search as ArchiveViewset.get_queryset does it with the index.
+    """
+    ret = PSMetadata.objects.all()
+    if event_type is not None:
+        ret = ret.filter(id__in=PSEventTypes.objects.filter(event_type=event_type).values('metadata_id'))
+    search_qs = [search_filter(SEARCH_KIND_SUBJECT, k, [v]) for k, v in subject_filters]
+    search_qs += [search_filter(SEARCH_KIND_PARAMETER, k, [v]) for k, v in parameter_filters]
+    return ret.filter(*search_qs)
+
+def searches(num_hosts):
+    src = host(random.randrange(num_hosts))
+    dst = host(random.randrange(num_hosts))
+    return [
+        ('source', [('source', src)], [], None),
+        ('source+destination+event-type', [('source', src), ('destination', dst)], [], 'throughput'),
+        ('tool-name+parameters', [('tool-name', 'bwctl/iperf3')],
+            [('time-interval', '7200'), ('ip-transport-protocol', 'udp')], None),
+        ('source+parameter', [('source', src)], [('bw-parallel-streams', '4')], 'throughput'),
+    ]
+
+def time_query(queryset, limit, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        count = queryset.count()
+        ids = list(queryset.order_by('metadata_key').values_list('id', flat=True)[:limit])
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark archive metadata searches")
+    parser.add_argument('-n', '--number', type=int, default=1000000,
+        help="Number of metadata objects to generate (default: 1000000)")
+    parser.add_argument('--hosts', type=int, default=5000,
+        help="Number of distinct hosts in the subjects (default: 5000)")
+    parser.add_argument('-b', '--batch-size', type=int, default=5000,
+        help="Number of metadata objects to insert at a time (default: 5000)")
+    parser.add_argument('-l', '--limit', type=int, default=1500,
+        help="Page size of the searches (default: 1500)")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help="Number of times to repeat each search, the best is reported (default: 3)")
+    args = parser.parse_args()
+
+    try:
+        with transaction.atomic():
+            start = time.time()
+            generate(args.number, args.hosts, args.batch_size)
+            print("generated %d metadata objects in %.1fs" % (args.number, time.time() - start))
+            print("%-32s %10s %12s %12s" % ("search", "matches", "joins (s)", "index (s)"))
+            for name, subject_filters, parameter_filters, event_type in searches(args.hosts):
+                join_time, join_count = time_query(join_queryset(subject_filters, parameter_filters, event_type), args.limit, args.repeat)
+                index_time, index_count = time_query(index_queryset(subject_filters, parameter_filters, event_type), args.limit, args.repeat)
+                if join_count != index_count:
+                    print("%s: %d matches with joins but %d with the index" % (name, join_count, index_count))
+                print("%-32s %10d %12.4f %12.4f" % (name, index_count, join_time, index_time))
+            raise Rollback()
+    except Rollback:
+        pass
+
+if __name__ == '__main__':
+    main()